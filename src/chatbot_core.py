@@ -1,20 +1,283 @@
 import os
 import json
+import atexit
+import asyncio
+import time
+import hashlib
+import threading
+import itertools
+import importlib.util
+import httpx
+import torch
 import chromadb
 from groq import AsyncGroq
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
-from datetime import datetime
-from typing import Dict, List
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # orjson è opzionale: stesso risultato con la stdlib, solo più lento
+    orjson = None
+
+from core.chatbot import configure_cpu_threads
 
 load_dotenv()
 
+@dataclass(frozen=True)
+class LLMConfig:
+    """Configurazione LLM, letta una volta all'avvio (accesso ad attributo invece di dict.get)"""
+    provider: str = "groq"
+    model: str = "llama-3.1-8b-instant"
+    temperature: float = 0.7
+    max_tokens: int = 500
+    api_key_env: str = "GROQ_API_KEY"
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LLMConfig":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+
+# Prompt di sistema statico: resta identico tra le richieste, così il provider può
+# riutilizzare la cache KV del prefisso
+SYSTEM_PROMPT = (
+    "Sei un assistente domestico esperto e amichevole. "
+    "Rispondi in italiano in modo pratico, dettagliato e amichevole. "
+    "Se usi informazioni dalla knowledge base, incorporale naturalmente nella risposta."
+)
+
+# Chroma accetta array numpy solo dalle versioni recenti; prima servono liste Python
+_CHROMA_ACCEPTS_NUMPY = tuple(int(p) for p in chromadb.__version__.split(".")[:2]) >= (0, 6)
+
+
+def to_chroma(embeddings: np.ndarray) -> Union[np.ndarray, List[List[float]]]:
+    """Converte una matrice di embedding nel formato accettato da questa versione di Chroma"""
+    embeddings = np.atleast_2d(embeddings)
+    return embeddings if _CHROMA_ACCEPTS_NUMPY else embeddings.tolist()
+
+
+class FaissCollection:
+    """Indice FAISS in memoria (prodotto scalare su vettori normalizzati) con snapshot su disco.
+
+    Espone lo stesso sottoinsieme dell'API di una collection Chroma usato dal chatbot,
+    così può sostituirla per knowledge base piccole (ricerca esatta, nessun SQLite).
+
+    Con quantize=True l'indice scandito a ogni query è int8 (IndexScalarQuantizer, 4x meno
+    byte letti); i candidati (fino a RERANK_FACTOR * k) vengono poi riordinati con il
+    prodotto scalare esatto sui vettori float32.
+    """
+
+    RERANK_FACTOR = 4
+
+    def __init__(self, path: str, dim: int, quantize: bool = False):
+        import faiss
+
+        self._faiss = faiss
+        self.path = path
+        self.index_path = os.path.join(path, "index.faiss")
+        self.docs_path = os.path.join(path, "docs.json")
+        self.vectors_path = os.path.join(path, "vectors.npy")
+        self.ids: List[str] = []
+        self.docs: List[str] = []
+        self.metas: List[Dict] = []
+        self.vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.index_path) and os.path.exists(self.docs_path):
+            self.index = faiss.read_index(self.index_path)
+            with open(self.docs_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self.ids = snapshot["ids"]
+            self.docs = snapshot["documents"]
+            self.metas = snapshot["metadatas"]
+            if os.path.exists(self.vectors_path):
+                self.vectors = np.load(self.vectors_path)
+        elif quantize:
+            self.index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            # Vettori normalizzati: ogni componente sta in [-1, 1], basta addestrare su quell'intervallo
+            self.index.train(np.vstack([np.full(dim, -1.0), np.full(dim, 1.0)]).astype(np.float32))
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+        else:
+            self.index = faiss.IndexFlatIP(dim)
+
+    def count(self) -> int:
+        return self.index.ntotal
+
+    def add(self, documents: List[str], embeddings, metadatas: List[Dict], ids: List[str]):
+        vectors = np.ascontiguousarray(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        with self._lock:
+            self.index.add(vectors)
+            if self.vectors is not None:
+                self.vectors = np.vstack([self.vectors, vectors])
+            self.docs.extend(documents)
+            self.metas.extend(metadatas)
+            self.ids.extend(ids)
+        # SIGTERM e crash non eseguono atexit: si salva subito dopo ogni aggiunta
+        self.persist()
+
+    def _search(self, queries: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        if self.vectors is None:
+            scores, indices = self.index.search(queries, k)
+            return [[(i, float(score)) for i, score in zip(row, row_scores) if i >= 0]
+                    for row, row_scores in zip(indices, scores)]
+
+        # Candidati dall'indice int8, poi re-rank esatto in float32
+        _, indices = self.index.search(queries, min(self.RERANK_FACTOR * k, self.count()))
+        hits = []
+        for query, row in zip(queries, indices):
+            candidates = row[row >= 0]
+            exact = self.vectors[candidates] @ query
+            best = np.argsort(-exact)[:k]
+            hits.append([(int(candidates[j]), float(exact[j])) for j in best])
+        return hits
+
+    def query(self, query_embeddings, n_results: int = 10) -> Dict[str, List[List[Any]]]:
+        queries = np.ascontiguousarray(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        hits = self._search(queries, n_results)
+        return {
+            "ids": [[self.ids[i] for i, _ in row] for row in hits],
+            "documents": [[self.docs[i] for i, _ in row] for row in hits],
+            "metadatas": [[self.metas[i] for i, _ in row] for row in hits],
+            # Distanza coseno, come una collection Chroma con hnsw:space=cosine
+            "distances": [[1 - score for _, score in row] for row in hits],
+        }
+
+    def get(self, include: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+        return {"ids": list(self.ids), "documents": list(self.docs), "metadatas": list(self.metas)}
+
+    def persist(self):
+        """Scrive indice e documenti su disco (dopo ogni add e, per sicurezza, all'uscita)"""
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            # File temporaneo + os.replace: un'interruzione non lascia mai file troncati.
+            # docs.json per ultimo, è il file che segnala uno snapshot completo
+            self._faiss.write_index(self.index, self.index_path + ".tmp")
+            os.replace(self.index_path + ".tmp", self.index_path)
+            if self.vectors is not None:
+                with open(self.vectors_path + ".tmp", "wb") as f:
+                    np.save(f, self.vectors)
+                os.replace(self.vectors_path + ".tmp", self.vectors_path)
+            with open(self.docs_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"ids": self.ids, "documents": self.docs, "metadatas": self.metas}, f, ensure_ascii=False)
+            os.replace(self.docs_path + ".tmp", self.docs_path)
+
+
+# Client Groq condivisi: un solo pool di connessioni keep-alive per processo
+_LLM_CLIENT_CACHE: Dict[str, AsyncGroq] = {}
+_LLM_CLIENT_LOCK = threading.Lock()
+
+
+def get_llm_client(api_key: str) -> AsyncGroq:
+    """Restituisce il client AsyncGroq (HTTP/2 se disponibile h2) condiviso tra le istanze"""
+    client = _LLM_CLIENT_CACHE.get(api_key)
+    if client is None:
+        with _LLM_CLIENT_LOCK:
+            client = _LLM_CLIENT_CACHE.get(api_key)
+            if client is None:
+                http_client = httpx.AsyncClient(
+                    http2=importlib.util.find_spec("h2") is not None,
+                    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+                    timeout=30.0
+                )
+                client = AsyncGroq(api_key=api_key, http_client=http_client)
+                _LLM_CLIENT_CACHE[api_key] = client
+    return client
+
+
+class HalfPrecisionEncoder:
+    """SentenceTransformer in bfloat16 (CPU con AMX/AVX512-BF16) o float16 (GPU).
+
+    Dimezza i byte dei pesi letti a ogni forward; gli embedding restituiti sono
+    sempre float32, compatibili con quelli già salvati nell'indice.
+    """
+
+    def __init__(self, model: SentenceTransformer, dtype: torch.dtype):
+        self.model = model.to(dtype)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, sentences: Union[str, List[str]], convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        # numpy non supporta bfloat16: si passa dal tensore e si torna a float32
+        kwargs.pop("convert_to_tensor", None)
+        embeddings = self.model.encode(sentences, convert_to_tensor=True, **kwargs)
+        return embeddings.float().cpu().numpy()
+
+
+def half_precision_dtype() -> Optional[torch.dtype]:
+    """dtype a precisione ridotta supportato in hardware da questa macchina, se presente"""
+    if torch.cuda.is_available():
+        return torch.float16
+    if not torch.backends.mkldnn.is_available():
+        return None
+    for probe in ("_is_amx_tile_supported", "_is_avx512_bf16_supported"):
+        check = getattr(torch.cpu, probe, None)
+        if check is not None and check():
+            return torch.bfloat16
+    return None
+
+
+# Modelli di embedding condivisi tra tutte le istanze del processo
+_EMBEDDER_CACHE: Dict[Tuple[str, str], Any] = {}
+_EMBEDDER_LOCK = threading.Lock()
+
+
+def get_encoder(name: str, backend: str = "torch", cache_dir: Optional[str] = None) -> Any:
+    """Restituisce il modello di embedding, caricandolo una sola volta per processo"""
+    key = (backend, name)
+    encoder = _EMBEDDER_CACHE.get(key)
+    if encoder is None:
+        with _EMBEDDER_LOCK:
+            encoder = _EMBEDDER_CACHE.get(key)
+            if encoder is None:
+                if backend == "onnx":
+                    from core.embeddings import OnnxEmbedder
+                    encoder = OnnxEmbedder(name, cache_dir or "./onnx_models")
+                elif backend == "half":
+                    encoder = HalfPrecisionEncoder(SentenceTransformer(name), half_precision_dtype())
+                else:
+                    encoder = SentenceTransformer(name)
+                _EMBEDDER_CACHE[key] = encoder
+    return encoder
+
+
 class HomeChatbot:
+    # Template del messaggio utente compilati una volta: per richiesta resta solo la sostituzione
+    _PROMPT_NO_RAG = "DOMANDA UTENTE: {q}"
+    _PROMPT_RAG = "{intro}\n{ctx}\n\nDOMANDA UTENTE: {q}"
+    _INTRO_FOUND = "Ecco informazioni rilevanti dalla tua knowledge base:"
+    _INTRO_MISSING = "Non ho informazioni specifiche, ma posso aiutarti con la mia conoscenza generale:"
+    _CONTEXT_MISSING = "Nessuna informazione specifica trovata."
+
+    EXACT_CACHE_MAXSIZE = 1024
+    EXACT_CACHE_TTL = 600  # secondi
+    EMBEDDING_CACHE_MAXSIZE = 2048
+    # Spazio coseno e HNSW più denso: la knowledge base è piccola, la recall conta più del tempo di build
+    COLLECTION_METADATA = {
+        "hnsw:space": "cosine",
+        "hnsw:construction_ef": 128,
+        "hnsw:M": 24,
+        "hnsw:search_ef": 100,
+    }
+
     def __init__(self, config_path: str = "./configs/test_small_model.json"):
         """Inizializza il chatbot in base al file di configurazione"""
         self.config = self.load_config(config_path)
-        self.llm_config = self.config.get("llm", {})
+        self.llm = LLMConfig.from_dict(self.config.get("llm", {}))
         self.rag_config = self.config.get("rag", {})
+        self.cache_config = self.config.get("semantic_cache", {})
+        self.semantic_cache = None
+        # hash messaggio -> (scadenza time.monotonic(), risposta); svuotata a ogni nuova conoscenza
+        self._exact_cache: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+        self._emb_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._emb_lock = threading.Lock()
+        # Id documento = prefisso calcolato all'avvio + contatore monotono (niente orologio/RNG per insert)
+        self._id_prefix = format(time.time_ns() // 1_000_000, "x")
+        self._id_seq = itertools.count()
         self.verbose = self.config.get("logging", {}).get("verbose", False)
 
         if self.verbose:
@@ -24,10 +287,15 @@ class HomeChatbot:
         if self.rag_config.get("enabled", True):
             self.setup_rag()
             self.load_base_knowledge()
+            if self.cache_config.get("enabled", False):
+                self.setup_semantic_cache()
 
     def load_config(self, path: str) -> Dict:
         """Carica configurazione da file JSON"""
         try:
+            if orjson is not None:
+                with open(path, "rb") as f:
+                    return orjson.loads(f.read())
             with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
         except Exception as e:
@@ -35,12 +303,12 @@ class HomeChatbot:
 
     # ==== LLM SETUP ====
     def setup_llm(self):
-        provider = self.llm_config.get("provider", "groq").lower()
+        provider = self.llm.provider.lower()
         if provider == "groq":
-            api_key = os.getenv("GROQ_API_KEY")
+            api_key = os.getenv(self.llm.api_key_env)
             if not api_key:
-                raise ValueError("⚠️ Mancante GROQ_API_KEY nelle variabili d'ambiente")
-            self.llm_client = AsyncGroq(api_key=api_key)
+                raise ValueError(f"⚠️ Mancante {self.llm.api_key_env} nelle variabili d'ambiente")
+            self.llm_client = get_llm_client(api_key)
         else:
             raise NotImplementedError(f"Provider LLM '{provider}' non supportato")
 
@@ -49,47 +317,176 @@ class HomeChatbot:
         path = self.rag_config.get("chroma_path", "./chroma_db")
         os.makedirs(path, exist_ok=True)
         self.chroma_client = chromadb.PersistentClient(path=path)
-        self.collection = self.chroma_client.get_or_create_collection(
-            self.rag_config.get("collection_name", "default_collection")
-        )
+
+        # Stesso default di main.py (metà dei core logici), impostato prima di caricare il modello
+        configure_cpu_threads(int(self.rag_config.get("num_threads") or os.getenv("EMBED_NUM_THREADS") or 0))
 
         model_name = self.rag_config.get("embedding_model", "all-MiniLM-L6-v2")
         if self.verbose:
             print(f"📥 Caricamento modello embeddings: {model_name}")
-        self.embedder = SentenceTransformer(model_name)
+        backend = self.rag_config.get("embedding_backend", "torch").lower()
+        if backend == "onnx":
+            try:
+                self.embedder = get_encoder(model_name, "onnx", os.path.join(path, "onnx"))
+            except ImportError as e:
+                print(f"⚠️ Backend ONNX non disponibile ({e}), uso PyTorch. Installa: pip install optimum[onnxruntime]")
+                self.embedder = get_encoder(model_name)
+        elif self.rag_config.get("half_precision", False) and half_precision_dtype() is not None:
+            self.embedder = get_encoder(model_name, "half")
+        else:
+            self.embedder = get_encoder(model_name)
         if self.verbose:
             print("✅ Modello embedding caricato!")
 
+        self.collection = None
+        if self.rag_config.get("vector_store", "chroma").lower() == "faiss":
+            try:
+                self.collection = FaissCollection(
+                    self.rag_config.get("faiss_path", os.path.join(path, "faiss")),
+                    self.embedder.get_sentence_embedding_dimension(),
+                    quantize=self.rag_config.get("quantize_int8", False)
+                )
+                # Ogni add salva già su disco: qui resta solo il flush finale
+                atexit.register(self.collection.persist)
+            except ImportError:
+                print("⚠️ FAISS non disponibile, uso Chroma. Installa: pip install faiss-cpu")
+        if self.collection is None:
+            self.collection = self.chroma_client.get_or_create_collection(
+                self.rag_config.get("collection_name", "default_collection"),
+                metadata=self.COLLECTION_METADATA
+            )
+        # Contatore e categorie locali: evitano round-trip su Chroma a ogni insert/query/stats
+        self._doc_count = self.collection.count()
+        self._categories = set()
+        if self._doc_count:
+            self._categories = {m.get("category", "generale")
+                                for m in self.collection.get(include=["metadatas"])["metadatas"]}
+
+    def _encode_cached(self, text: str) -> np.ndarray:
+        """Embedding L2-normalizzato float32 (coseno == prodotto scalare), con cache LRU"""
+        with self._emb_lock:
+            embedding = self._emb_cache.get(text)
+            if embedding is not None:
+                self._emb_cache.move_to_end(text)
+                return embedding
+
+        embedding = np.asarray(
+            self.embedder.encode(text, convert_to_numpy=True, normalize_embeddings=True),
+            dtype=np.float32
+        )
+        with self._emb_lock:
+            self._emb_cache[text] = embedding
+            if len(self._emb_cache) > self.EMBEDDING_CACHE_MAXSIZE:
+                self._emb_cache.popitem(last=False)
+        return embedding
+
+    # ==== SEMANTIC CACHE ====
+    def setup_semantic_cache(self):
+        """Collection separata che associa embedding delle domande a risposte già generate"""
+        name = f"{self.rag_config.get('collection_name', 'default_collection')}_response_cache"
+        self.semantic_cache = self.chroma_client.get_or_create_collection(
+            name, metadata={"hnsw:space": "cosine"}
+        )
+        if self.verbose:
+            print(f"✅ Cache semantica attiva ({self.semantic_cache.count()} risposte)")
+
+    def get_cached_response(self, query_embedding: np.ndarray) -> Optional[str]:
+        """Restituisce una risposta già generata per una domanda simile, se ancora valida"""
+        if self.semantic_cache is None or self.semantic_cache.count() == 0:
+            return None
+        results = self.semantic_cache.query(query_embeddings=to_chroma(query_embedding), n_results=1)
+        if not results["ids"] or not results["ids"][0]:
+            return None
+
+        similarity = 1 - results["distances"][0][0]
+        if similarity < self.cache_config.get("similarity_threshold", 0.93):
+            return None
+        if results["metadatas"][0][0].get("expires_at", 0) < time.time():
+            self.semantic_cache.delete(ids=[results["ids"][0][0]])
+            return None
+        return results["documents"][0][0]
+
+    def cache_response(self, query_embedding: np.ndarray, response: str):
+        """Salva la risposta nella cache semantica con scadenza"""
+        if self.semantic_cache is None:
+            return
+        self.semantic_cache.add(
+            documents=[response],
+            embeddings=to_chroma(query_embedding),
+            metadatas=[{"expires_at": time.time() + self.cache_config.get("ttl", 86400)}],
+            ids=[self._next_id("resp")]
+        )
+
+    def _invalidate_answers(self):
+        """Dopo nuove conoscenze le risposte già date possono essere superate: svuota entrambe le cache"""
+        self._exact_cache.clear()
+        if self.semantic_cache is not None:
+            ids = self.semantic_cache.get(include=[])["ids"]
+            if ids:
+                self.semantic_cache.delete(ids=ids)
+
     # ==== KNOWLEDGE BASE ====
+    def _next_id(self, category: str) -> str:
+        return f"{category}_{self._id_prefix}_{next(self._id_seq):08x}"
+
     def load_base_knowledge(self):
-        if self.collection.count() == 0:
+        if self._doc_count == 0:
             base_knowledge = [
                 ("Pulizia: bicarbonato e aceto per il forno.", "pulizia"),
                 ("Pulizia: multiuso naturale con aceto e limone.", "pulizia"),
                 ("Utenze: verifica le bollette mensilmente.", "utenze"),
             ]
-            for i, (text, category) in enumerate(base_knowledge):
-                self.add_knowledge(text, category)
+            texts = [text for text, _ in base_knowledge]
+            categories = [category for _, category in base_knowledge]
+            self.add_knowledge_batch(texts, categories)
             if self.verbose:
                 print(f"✅ Aggiunte {len(base_knowledge)} conoscenze base")
 
     def add_knowledge(self, content: str, category: str = "generale") -> str:
-        doc_id = f"{category}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.collection.count()}"
-        embedding = self.embedder.encode(content).tolist()
+        doc_id = self._next_id(category)
+        embedding = self._encode_cached(content)
         self.collection.add(
             documents=[content],
-            embeddings=[embedding],
+            embeddings=to_chroma(embedding),
             metadatas=[{"category": category}],
             ids=[doc_id]
         )
+        self._doc_count += 1
+        self._categories.add(category)
+        self._invalidate_answers()
         return doc_id
 
+    def add_knowledge_batch(self, contents: List[str], categories: List[str]) -> List[str]:
+        """Aggiunge più conoscenze con un solo encode e un solo add su Chroma"""
+        if not contents:
+            return []
+        ids = [self._next_id(category) for category in categories]
+        # Smart batching: testi di lunghezza simile nello stesso batch → meno padding,
+        # poi si ripristina l'ordine originale con la permutazione inversa
+        order = np.argsort([len(text) for text in contents], kind="stable")
+        embeddings = self.embedder.encode([contents[i] for i in order], batch_size=32,
+                                         convert_to_numpy=True, normalize_embeddings=True)
+        embeddings = np.asarray(embeddings, dtype=np.float32)[np.argsort(order)]
+        self.collection.add(
+            documents=list(contents),
+            embeddings=to_chroma(embeddings),
+            metadatas=[{"category": category} for category in categories],
+            ids=ids
+        )
+        self._doc_count += len(ids)
+        self._categories.update(categories)
+        self._invalidate_answers()
+        return ids
+
     # ==== QUERY + LLM ====
     def search_knowledge(self, query: str, n_results: int = 3) -> List[Dict]:
-        query_embedding = self.embedder.encode(query).tolist()
+        # Knowledge base vuota: niente encode né query
+        if self._doc_count == 0:
+            return []
+        query_embedding = self._encode_cached(query)
         results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=min(n_results, self.collection.count())
+            query_embeddings=to_chroma(query_embedding),
+            n_results=min(n_results, self._doc_count)
         )
         knowledge_list = []
         if results["documents"] and results["documents"][0]:
@@ -100,56 +497,113 @@ class HomeChatbot:
                 })
         return knowledge_list
 
+    async def _search_async(self, query: str, n_results: int = 3) -> List[Dict]:
+        """Esegue search_knowledge (encode + query Chroma, CPU-bound) in un thread"""
+        return await asyncio.to_thread(self.search_knowledge, query, n_results)
+
     async def get_response(self, user_message: str, user_id: int) -> str:
-        """Genera risposta con o senza RAG"""
-        
-        # 1️⃣ Se RAG disabilitato nel config
-        if not self.rag_config.get("enabled", True):
-            prompt = f"""Sei un assistente domestico esperto e amichevole.
-    Rispondi in modo pratico, naturale e utile alla domanda seguente.
+        """Genera risposta con o senza RAG (raccoglie stream_response in un'unica stringa)"""
+        parts = [chunk async for chunk in self.stream_response(user_message, user_id)]
+        return "".join(parts).strip()
+
+    async def stream_response(self, user_message: str, user_id: int) -> AsyncIterator[str]:
+        """Genera la risposta in streaming: i pezzi arrivano man mano che l'LLM li produce"""
+
+        # 0️⃣ Cache esatta: stesso messaggio già risposto → lookup O(1)
+        key = hashlib.blake2b(user_message.encode(), digest_size=16).digest()
+        entry = self._exact_cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._exact_cache.move_to_end(key)
+                yield entry[1]
+                return
+            del self._exact_cache[key]
+
+        # Con la cache semantica l'embedding si calcola una volta sola, poi ricerca e lookup
+        # in cache (entrambe query Chroma) girano in parallelo su thread separati
+        query_embedding = None
+        if self.semantic_cache is not None:
+            try:
+                query_embedding = await asyncio.to_thread(self._encode_cached, user_message)
+            except Exception as e:
+                print(f"⚠️ Errore durante il calcolo dell'embedding: {e}")
+
+        # 1️⃣ RAG attivo → la ricerca conoscenze parte subito, prima del controllo in cache
+        search_task = None
+        if self.rag_config.get("enabled", True):
+            search_task = asyncio.create_task(self._search_async(user_message, 3))
 
-    DOMANDA UTENTE: {user_message}"""
+        # Cache semantica: domanda simile già risposta → niente chiamata LLM
+        if query_embedding is not None:
+            try:
+                cached = await asyncio.to_thread(self.get_cached_response, query_embedding)
+            except Exception as e:
+                cached = None
+                print(f"⚠️ Errore durante la lettura della cache semantica: {e}")
+            if cached is not None:
+                if search_task is not None:
+                    search_task.cancel()
+                yield cached
+                return
+        
+        # 2️⃣ Se RAG disabilitato nel config
+        if search_task is None:
+            user_content = self._PROMPT_NO_RAG.format_map({"q": user_message})
         else:
-            # 2️⃣ RAG attivo → cerca conoscenze
             try:
-                relevant_knowledge = self.search_knowledge(user_message, n_results=3)
+                relevant_knowledge = await search_task
             except Exception as e:
                 relevant_knowledge = []
                 print(f"⚠️ Errore durante la ricerca conoscenze: {e}")
             
             if relevant_knowledge:
                 context = "\n".join([f"[{k['category'].upper()}] {k['content']}" for k in relevant_knowledge])
-                context_intro = "Ecco informazioni rilevanti dalla tua knowledge base:"
+                context_intro = self._INTRO_FOUND
             else:
-                context = "Nessuna informazione specifica trovata."
-                context_intro = "Non ho informazioni specifiche, ma posso aiutarti con la mia conoscenza generale:"
+                context = self._CONTEXT_MISSING
+                context_intro = self._INTRO_MISSING
             
-            prompt = f"""Sei un assistente domestico esperto e amichevole.
-
-    {context_intro}
-    {context}
-
-    DOMANDA UTENTE: {user_message}
-
-    Rispondi in italiano in modo pratico, dettagliato e amichevole. Se usi informazioni dalla knowledge base, incorporale naturalmente nella risposta."""
+            user_content = self._PROMPT_RAG.format_map({"intro": context_intro, "ctx": context, "q": user_message})
 
-        # 3️⃣ Chiamata LLM
+        # 3️⃣ Chiamata LLM: prefisso di sistema identico a ogni richiesta (cacheable dal provider)
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_content},
+        ]
+        parts = []
         try:
-            response = await self.llm_client.chat.completions.create(
-                model=self.llm_config.get("model"),
-                messages=[{"role": "user", "content": prompt}],
-                temperature=self.llm_config.get("temperature", 0.7),
-                max_tokens=self.llm_config.get("max_tokens", 500)
+            stream = await self.llm_client.chat.completions.create(
+                model=self.llm.model,
+                messages=messages,
+                temperature=self.llm.temperature,
+                max_tokens=self.llm.max_tokens,
+                stream=True
             )
-            return response.choices[0].message.content.strip()
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
 
         except Exception as e:
-            return f"⚠️ Errore durante la generazione: {str(e)[:200]}"
+            yield f"⚠️ Errore durante la generazione: {str(e)[:200]}"
+            return
+
+        answer = "".join(parts).strip()
+
+        self._exact_cache[key] = (time.monotonic() + self.EXACT_CACHE_TTL, answer)
+        if len(self._exact_cache) > self.EXACT_CACHE_MAXSIZE:
+            self._exact_cache.popitem(last=False)
+
+        if query_embedding is not None:
+            try:
+                await asyncio.to_thread(self.cache_response, query_embedding, answer)
+            except Exception as e:
+                print(f"⚠️ Errore durante il salvataggio nella cache semantica: {e}")
 
     def get_stats(self) -> Dict:
         """Statistiche conoscenze"""
         return {
-            "total_docs": self.collection.count(),
-            "categories": list(set([m.get('category', 'generale')
-                for m in self.collection.get()['metadatas']]))
+            "total_docs": self._doc_count,
+            "categories": list(self._categories)
         }
@@ -1,8 +1,13 @@
 """Core package"""
-from .chatbot import HomeChatbot, LLMProvider, RAGSystem
+from .chatbot import HomeChatbot, LLMProvider, RAGSystem, configure_cpu_threads
+from .embeddings import OnnxEmbedder
+from .semantic_cache import SemanticCache
 
 __all__ = [
     'HomeChatbot',
     'LLMProvider',
     'RAGSystem',
+    'OnnxEmbedder',
+    'SemanticCache',
+    'configure_cpu_threads',
 ]
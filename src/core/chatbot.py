@@ -2,73 +2,357 @@
 Core chatbot functionality with improved architecture
 """
 import os
+import re
 import asyncio
 import logging
-from typing import Dict, List, Optional, Any
+import functools
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Literal, AsyncIterator, Union
 from datetime import datetime
 
 import chromadb
+import numpy as np
+import torch
 from groq import AsyncGroq
 from sentence_transformers import SentenceTransformer
 
+from .embeddings import OnnxEmbedder, SQ8Codec
 from utils.config_manager import AppConfig
 from utils.logger import LoggerMixin, log_performance
 from utils.helpers import (
     generate_document_id, 
-    MemoryCache, 
+    chunk_text,
+    stable_hash,
+    ts_ns,
+    iso_from_ns,
+    LRUCache, 
+    SharedCache,
     retry_async,
     create_error_response,
     create_success_response
 )
 
 
-class ChromaDBWrapper:
+# Static prompt prefixes: identical across requests so provider-side prompt caching can reuse them
+_PROMPT_PREFIX = (
+    "Sei un assistente domestico esperto e amichevole: pulizia naturale, utenze, "
+    "manutenzione e organizzazione della casa. Rispondi in italiano in modo pratico e conciso"
+)
+_QUESTION_HEADER = "\n\nDOMANDA UTENTE: "
+SYSTEM_PROMPT_NO_CTX = _PROMPT_PREFIX + "." + _QUESTION_HEADER
+SYSTEM_PROMPT_CTX_TMPL = (
+    _PROMPT_PREFIX + ", usando le informazioni della knowledge base quando rilevanti e integrando "
+    "con la tua conoscenza generale se non bastano.\n\nKNOWLEDGE BASE:\n"
+)
+
+# Fallback reply on generation errors (never cached)
+ERROR_RESPONSE = "⚠️ Mi dispiace, ho avuto un problema tecnico. Riprova tra poco!"
+
+# Categories are a small fixed set: uppercase each one once
+_upper = functools.lru_cache(maxsize=64)(str.upper)
+
+# Greetings/acknowledgements never match the knowledge base: skip the embed + search for them
+_TRIVIAL_RE = re.compile(
+    r'^(ciao|salve|buongiorno|buonasera|grazie( mille)?|ok(ay)?|va bene|perfetto|'
+    r'thanks|thank you|hello|hi|hey)[\s!.?]*$',
+    re.IGNORECASE
+)
+
+
+def needs_retrieval(message: str, min_words: int = 1) -> bool:
+    """Whether a message is worth an embed + vector search (greetings and too-short messages are not)"""
+    text = message.strip()
+    return len(text.split()) >= min_words and not _TRIVIAL_RE.match(text)
+
+# Chroma only accepts numpy embeddings from 0.6; older releases need Python lists
+_CHROMA_ACCEPTS_NUMPY = tuple(int(p) for p in chromadb.__version__.split(".")[:2]) >= (0, 6)
+
+
+def _to_chroma(embeddings: np.ndarray):
+    """Pass a (n, dim) float32 matrix to Chroma without list boxing when supported"""
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    return embeddings if _CHROMA_ACCEPTS_NUMPY else embeddings.tolist()
+
+
+def configure_cpu_threads(cpu_threads: int = 0) -> int:
+    """
+    Pin torch intra-op threads (0 = half the logical cores) and use a single inter-op thread
+    
+    Call once at process startup, before any model is loaded.
+    """
+    threads = cpu_threads or max(1, (os.cpu_count() or 2) // 2)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed once, before any inter-op parallel work has started
+        pass
+    return threads
+
+
+class ChromaDBWrapper(LoggerMixin):
     """Wrapper to make ChromaDB compatible with storage interface"""
     
-    def __init__(self, collection, embedder):
+    SQ8_RERANK_FACTOR = 4
+    
+    def __init__(self, collection, embedder, batch_size: int = 32, sq8_scan: bool = False):
         self.collection = collection
         self.embedder = embedder
+        self.batch_size = batch_size
+        
+        # Every encode path uses normalize_embeddings=True, so on a cosine collection
+        # the stored vectors are unit length and a plain dot product is the cosine
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        self._normalized = space in ("cosine", "ip")
+        if not self._normalized:
+            self.log_warning(
+                f"Collection uses '{space}' distance: similarity scores are approximate. "
+                "Rebuild the collection to switch to cosine."
+            )
+        # Document counts kept in memory: this wrapper is the only writer to the collection.
+        # Per-category counts bound n_results for filtered queries (Chroma 0.4 raises
+        # when asked for more neighbours than the filter matches)
+        self._count_lock = threading.Lock()
+        self._doc_count = 0
+        self._category_counts: Counter = Counter()
+        self._refresh_count()
+        
+        # Optional int8 (SQ8) copy of all vectors for an exact-reranked brute-force scan.
+        # Chroma keeps the float32 vectors and its HNSW graph (needed for the rerank and
+        # filtered queries), so this costs an extra quarter of the vector memory and an
+        # O(N) scan per query: worth it only on small stores, off by default.
+        self._sq8 = None
+        self._sq8_lock = threading.Lock()
+        self._sq8_recalibrating = False
+        if sq8_scan:
+            self._load_sq8_index()
+    
+    def _load_sq8_index(self):
+        """Quantize every stored vector, calibrating SQ8 ranges on them"""
+        with self._sq8_lock:
+            self._sq8, self._sq8_ids, self._sq8_codes = self._build_sq8_index()
+            self._sq8_id_set = set(self._sq8_ids)
+    
+    def _build_sq8_index(self):
+        """Codec, ids and codes for every vector currently in the collection"""
+        stored = self.collection.get(include=["embeddings"])
+        vectors = np.asarray(stored["embeddings"] or [], dtype=np.float32)
+        dim = vectors.shape[1] if vectors.ndim == 2 else self.embedder.get_sentence_embedding_dimension()
+        
+        codec = SQ8Codec(dim)
+        codec.calibrate(vectors)
+        codes = codec.quantize(vectors) if len(vectors) else np.zeros((0, dim), dtype=np.int8)
+        self.log_info(f"SQ8 scan index: {len(vectors)} vectors, {codes.nbytes} bytes")
+        return codec, list(stored["ids"]), codes
+    
+    def _recalibrate_sq8(self):
+        """Rebuild without holding the lock, then swap in (searches keep the old codes meanwhile)"""
+        try:
+            codec, ids, codes = self._build_sq8_index()
+            with self._sq8_lock:
+                known = set(ids)
+                # Rows indexed after the collection was read
+                missed = [doc_id for doc_id in self._sq8_ids if doc_id not in known]
+                if missed:
+                    stored = self.collection.get(ids=missed, include=["embeddings"])
+                    ids += list(stored["ids"])
+                    codes = np.vstack([codes, codec.quantize(np.asarray(stored["embeddings"], dtype=np.float32))])
+                self._sq8, self._sq8_ids, self._sq8_codes = codec, ids, codes
+                self._sq8_id_set = set(ids)
+        except Exception as e:
+            self.log_error("SQ8 recalibration failed", e)
+        finally:
+            self._sq8_recalibrating = False
+    
+    def _sq8_add(self, ids: List[str], embeddings: np.ndarray):
+        if self._sq8 is None:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._sq8_lock:
+            fresh = [i for i, doc_id in enumerate(ids) if doc_id not in self._sq8_id_set]
+            if not fresh:
+                return
+            vectors = vectors[fresh]
+            if not self._sq8_ids:
+                # First vectors: calibrate on them directly, no collection reload
+                self._sq8.calibrate(vectors)
+            elif not self._sq8.covers(vectors) and not self._sq8_recalibrating:
+                # Index the clipped codes now (the exact rerank absorbs the error) and
+                # recalibrate on all stored vectors off the write path
+                self._sq8_recalibrating = True
+                threading.Thread(target=self._recalibrate_sq8, name="sq8-recalibrate", daemon=True).start()
+            new_ids = [ids[i] for i in fresh]
+            self._sq8_ids.extend(new_ids)
+            self._sq8_id_set.update(new_ids)
+            self._sq8_codes = np.vstack([self._sq8_codes, self._sq8.quantize(vectors)])
     
     def count(self) -> int:
-        return self.collection.count()
+        return self._doc_count
+    
+    def _refresh_count(self) -> int:
+        """Re-read the counts from Chroma (needed only if something else writes to the collection)"""
+        metadatas = self.collection.get(include=["metadatas"])["metadatas"] or []
+        with self._count_lock:
+            self._doc_count = len(metadatas)
+            self._category_counts = Counter(
+                meta["category"] for meta in metadatas if meta and "category" in meta
+            )
+        return self._doc_count
+    
+    def _increment_count(self, categories: List[str]):
+        with self._count_lock:
+            self._doc_count += len(categories)
+            self._category_counts.update(categories)
+    
+    @staticmethod
+    def iso_timestamp(metadata: Dict) -> Optional[str]:
+        """ISO-8601 form of a document's insertion time, formatted only when read back"""
+        if "ts_ns" in metadata:
+            return iso_from_ns(metadata["ts_ns"])
+        ts = metadata.get("timestamp")  # documents stored before ts_ns
+        if isinstance(ts, (int, float)):
+            return datetime.fromtimestamp(ts).isoformat()
+        return ts
     
     def add_knowledge(self, content: str, category: str = "generale", metadata: Optional[Dict] = None) -> str:
-        doc_id = generate_document_id(content, category)
-        embedding = self.embedder.encode(content).tolist()
+        """Add a single document; it is persisted before the id is returned"""
+        return self.add_knowledge_batch([content], [category], [metadata])[0]
+    
+    def add_knowledge_batch(self, contents: List[str], categories: List[str],
+                            metadatas: Optional[List[Optional[Dict]]] = None) -> List[str]:
+        """Add many documents with a single encode pass and a single collection.add"""
+        if not contents:
+            return []
+        
+        ids = [generate_document_id(content, category) for content, category in zip(contents, categories)]
+        
+        # Skip documents already stored (or repeated in this batch) before encoding
+        known = self._existing_ids(ids)
+        new_rows = []
+        for i, doc_id in enumerate(ids):
+            if doc_id not in known:
+                known.add(doc_id)
+                new_rows.append(i)
+        if not new_rows:
+            return ids
         
-        doc_metadata = {"category": category, "timestamp": datetime.now().isoformat()}
-        if metadata:
-            doc_metadata.update(metadata)
+        new_contents = [contents[i] for i in new_rows]
+        embeddings = self._encode_batch(new_contents)
+        
+        timestamp = ts_ns()
+        doc_metadatas = []
+        for i in new_rows:
+            doc_metadata = {"category": categories[i], "ts_ns": timestamp}
+            if metadatas and metadatas[i]:
+                doc_metadata.update(metadatas[i])
+            doc_metadatas.append(doc_metadata)
         
         self.collection.add(
-            documents=[content],
-            embeddings=[embedding],
-            metadatas=[doc_metadata],
-            ids=[doc_id]
+            documents=new_contents,
+            embeddings=_to_chroma(embeddings),
+            metadatas=doc_metadatas,
+            ids=[ids[i] for i in new_rows]
         )
-        return doc_id
+        self._increment_count([meta["category"] for meta in doc_metadatas])
+        self._sq8_add([ids[i] for i in new_rows], embeddings)
+        return ids
     
-    def search_knowledge(self, query: str, n_results: int = 3, category: Optional[str] = None) -> List[Dict]:
-        query_embedding = self.embedder.encode(query).tolist()
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode many texts in one call
+        
+        SentenceTransformer sorts inputs by length so each batch pads to similar
+        lengths ("smart batching") and restores the original order afterwards.
+        """
+        return self.embedder.encode(
+            texts, batch_size=self.batch_size, show_progress_bar=False,
+            convert_to_numpy=True, normalize_embeddings=True
+        )
+    
+    def _existing_ids(self, ids: List[str]) -> set:
+        """Ids already persisted in the collection"""
+        return set(self.collection.get(ids=list(dict.fromkeys(ids)), include=[])["ids"])
+    
+    def search_knowledge(self, query: str, n_results: int = 3, category: Optional[str] = None,
+                         query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
+        if query_embedding is None:
+            query_embedding = self.embedder.encode(query, show_progress_bar=False, normalize_embeddings=True)
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        
+        if self._sq8 is not None and not category and self._sq8_ids:
+            return self._search_sq8(query_embedding, n_results)
+        
+        query_kwargs = {}
+        available = self._doc_count
+        if category:
+            # Filter inside Chroma instead of returning rows and dropping them
+            query_kwargs["where"] = {"category": category}
+            available = self._category_counts.get(category, 0)
+        if available <= 0:
+            return []
+        
         results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=min(n_results, max(1, self.collection.count()))
+            query_embeddings=_to_chroma(query_embedding),
+            n_results=min(n_results, available),
+            **query_kwargs
         )
         
-        knowledge_list = []
-        if results["documents"] and results["documents"][0]:
-            for i, doc in enumerate(results["documents"][0]):
-                distance = results["distances"][0][i] if results.get("distances") else 0
-                similarity = 1 - distance
-                
-                knowledge_list.append({
-                    "content": doc,
-                    "category": results["metadatas"][0][i].get("category", "generale"),
-                    "similarity": similarity,
-                    "metadata": results["metadatas"][0][i]
-                })
-        
-        return knowledge_list
+        if not results["documents"] or not results["documents"][0]:
+            return []
+        
+        docs = results["documents"][0]
+        dists = (results.get("distances") or [[0] * len(docs)])[0]
+        metas = results["metadatas"][0]
+        return [
+            {
+                "content": doc,
+                "category": meta.get("category", "generale"),
+                # Cosine distance lies in [0, 2]; clamp float noise at the edges
+                "similarity": 1.0 - min(max(dist, 0.0), 2.0),
+                "metadata": meta
+            }
+            for doc, dist, meta in zip(docs, dists, metas)
+        ]
+    
+    def _search_sq8(self, query_embedding: np.ndarray, n_results: int) -> List[Dict]:
+        """Asymmetric int8 scan for candidates, then exact float32 rerank of the top ones"""
+        with self._sq8_lock:
+            scores = self._sq8.scores(query_embedding, self._sq8_codes)
+            top = self._top_k(scores, n_results * self.SQ8_RERANK_FACTOR)
+            candidate_ids = [self._sq8_ids[i] for i in top]
+        
+        candidates = self.collection.get(ids=candidate_ids, include=["documents", "metadatas", "embeddings"])
+        exact = self._rerank(query_embedding, np.asarray(candidates["embeddings"], dtype=np.float32))
+        docs, metas = candidates["documents"], candidates["metadatas"]
+        return [
+            {
+                "content": docs[i],
+                "category": metas[i].get("category", "generale"),
+                "similarity": float(exact[i]),
+                "metadata": metas[i]
+            }
+            for i in self._top_k(exact, n_results)
+        ]
+    
+    def _rerank(self, query_vec: np.ndarray, cand_matrix: np.ndarray) -> np.ndarray:
+        """Exact similarities of all candidates in one BLAS matrix-vector product"""
+        cand_matrix = np.ascontiguousarray(cand_matrix, dtype=np.float32)
+        similarities = cand_matrix @ query_vec
+        if not self._normalized:
+            norms = np.linalg.norm(cand_matrix, axis=1) * np.linalg.norm(query_vec)
+            similarities /= np.clip(norms, 1e-12, None)
+        return similarities
+    
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first (O(n) partition + sort of k)"""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
     
     def get_stats(self) -> Dict:
         return {
@@ -80,6 +364,13 @@ class ChromaDBWrapper:
 class LLMProvider(LoggerMixin):
     """LLM Provider interface"""
     
+    # Groq speed tiers; None means the model from the configuration
+    MODEL_TIERS = {
+        "instant": "llama-3.1-8b-instant",
+        "balanced": None,
+        "fast70b": "llama-3.3-70b-versatile",
+    }
+    
     def __init__(self, config: AppConfig):
         self.config = config.llm
         self.client = None
@@ -97,37 +388,80 @@ class LLMProvider(LoggerMixin):
         else:
             raise NotImplementedError(f"Provider '{self.config.provider}' not supported")
     
-    @log_performance(logging.getLogger("LLMProvider"))
-    async def generate_response(self, messages: List[Dict[str, str]]) -> str:
-        """Generate response using LLM"""
+    async def stream_response(self, messages: List[Dict[str, str]],
+                              tier: Literal["instant", "balanced", "fast70b"] = "balanced",
+                              max_tokens: Optional[int] = None,
+                              temperature: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Stream response chunks from the LLM as they are generated
+        
+        max_tokens/temperature override the configured values for this call;
+        generation time grows linearly with the tokens produced, so callers
+        expecting short answers should pass a lower max_tokens. Errors are
+        logged and re-raised so callers never mistake them for an answer.
+        """
+        model = self.MODEL_TIERS.get(tier) or self.config.model
+        if max_tokens is None:
+            max_tokens = self.config.max_tokens
+        if temperature is None:
+            temperature = self.config.temperature
         try:
-            response = await retry_async(
+            stream = await retry_async(
                 lambda: self.client.chat.completions.create(
-                    model=self.config.model,
+                    model=model,
                     messages=messages,
-                    temperature=self.config.temperature,
-                    max_tokens=self.config.max_tokens
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True
                 )
             )
             
-            content = response.choices[0].message.content.strip()
-            self.log_debug(f"Generated response: {len(content)} characters")
-            return content
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
             
         except Exception as e:
             self.log_error(f"Error generating response: {e}", e)
-            return f"⚠️ Error generating response: {str(e)[:200]}"
+            raise
+    
+    @log_performance(logging.getLogger("LLMProvider"))
+    async def generate_response(self, messages: List[Dict[str, str]],
+                                tier: Literal["instant", "balanced", "fast70b"] = "balanced",
+                                max_tokens: Optional[int] = None,
+                                temperature: Optional[float] = None) -> str:
+        """Generate response using LLM"""
+        content = "".join([
+            chunk async for chunk in self.stream_response(messages, tier, max_tokens, temperature)
+        ]).strip()
+        self.log_debug(f"Generated response ({tier}): {len(content)} characters")
+        return content
 
 
 class RAGSystem(LoggerMixin):
     """RAG (Retrieval-Augmented Generation) System with multiple storage backends"""
     
+    _PARTIAL_TAG = "__partial__"
+    QUERY_EMBEDDING_CACHE_SIZE = 1024
+    INGEST_QUEUE_SIZE = 256
+    STATS_TTL = 30  # seconds
+    _STATS_KEY = "__stats__"
+    INGEST_BATCH_INTERVAL = 0.05  # seconds
+    
     def __init__(self, config: AppConfig):
         self.config = config.rag
-        self.cache = MemoryCache(default_ttl=300)  # 5 minutes cache
+        self.cache = LRUCache(maxsize=1024, ttl=300)  # 5 minutes cache
+        # Query embeddings by exact text, shared by every storage backend.
+        # Embeddings never change for a given text, so adding knowledge needs no invalidation.
+        self._embed_query = functools.lru_cache(maxsize=self.QUERY_EMBEDDING_CACHE_SIZE)(self._encode_query)
         self.storage = None
         self.embedder = None
         
+        # Micro-batching ingestion queue, bound to the event loop that first uses it
+        self._ingest_q = None
+        self._ingest_loop = None
+        self._ingest_task = None
+        
         if self.config.enabled:
             self._setup_rag()
         else:
@@ -138,7 +472,9 @@ class RAGSystem(LoggerMixin):
         try:
             # Initialize embedding model first (needed by both backends)
             self.log_info(f"Loading embedding model: {self.config.embedding_model}")
-            self.embedder = SentenceTransformer(self.config.embedding_model)
+            self.embedder = self._load_embedder()
+            if self.config.compile_model:
+                self._compile_embedder()
             
             # Choose storage backend
             storage_type = getattr(self.config, 'storage_type', 'chromadb').lower()
@@ -150,11 +486,90 @@ class RAGSystem(LoggerMixin):
             
             self.log_success(f"RAG system initialized with {storage_type} backend")
             self._load_base_knowledge()
+            self._warmup_embedder()
             
         except Exception as e:
             self.log_error(f"Failed to setup RAG system: {e}", e)
             raise
     
+    def _compile_embedder(self):
+        """Wrap the transformer in torch.compile (PyTorch >= 2.0, torch backend only)"""
+        if not hasattr(torch, "compile") or not isinstance(self.embedder, SentenceTransformer):
+            self.log_warning("torch.compile not available for this embedder, skipping")
+            return
+        try:
+            transformer = self.embedder[0]
+            transformer.auto_model = torch.compile(transformer.auto_model, mode="reduce-overhead")
+            self.log_info("Embedding model compiled with torch.compile")
+        except Exception as e:
+            self.log_warning(f"torch.compile failed, using eager model: {e}")
+    
+    def _warmup_embedder(self):
+        """Run a throwaway encode so graph optimization and buffer allocation happen at boot"""
+        try:
+            self.embedder.encode(["warmup"] * 2, batch_size=2, show_progress_bar=False)
+        except Exception as e:
+            self.log_warning(f"Embedder warmup failed: {e}")
+    
+    def _load_embedder(self) -> SentenceTransformer:
+        """Load the embedding model with the configured inference backend"""
+        backend = getattr(self.config, 'embedder_backend', 'torch').lower()
+        if backend == "torch":
+            return self._load_torch_embedder()
+        
+        try:
+            if backend == "onnx":
+                try:
+                    embedder = self._load_onnx_embedder()
+                except (ImportError, TypeError):
+                    # sentence-transformers<3.2 has no ONNX backend: run it through Optimum
+                    embedder = OnnxEmbedder(
+                        self.config.embedding_model, os.path.join(self.config.chroma_path, "onnx")
+                    )
+            elif backend == "openvino":
+                embedder = SentenceTransformer(self.config.embedding_model, backend="openvino")
+            else:
+                raise ValueError(f"Unknown embedder backend '{backend}'")
+            
+            self.log_success(f"Embedding model running on {backend} backend")
+            return embedder
+            
+        except Exception as e:
+            # Requires sentence-transformers>=3.2 with the onnx/openvino extras
+            self.log_error(f"Failed to load {backend} embedder backend: {e}")
+            self.log_warning("Falling back to PyTorch embedder")
+            return self._load_torch_embedder()
+    
+    def _load_torch_embedder(self) -> SentenceTransformer:
+        """Load the PyTorch model on the configured device, in fp16 on CUDA"""
+        device = self.config.device
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        
+        embedder = SentenceTransformer(self.config.embedding_model, device=device)
+        if device.startswith("cuda") and self.config.fp16:
+            embedder = embedder.half()
+        
+        self.log_info(f"Embedding model on {device}{' (fp16)' if device.startswith('cuda') and self.config.fp16 else ''}")
+        return embedder
+    
+    def _load_onnx_embedder(self) -> SentenceTransformer:
+        """Load an int8 (AVX512-VNNI) quantized ONNX model, exporting it on first boot"""
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        
+        model_dir = os.path.join(
+            self.config.chroma_path, "onnx", self.config.embedding_model.replace("/", "__")
+        )
+        file_name = "onnx/model_qint8_avx512_vnni.onnx"
+        
+        if not os.path.exists(os.path.join(model_dir, file_name)):
+            self.log_info("Exporting quantized ONNX embedding model (first boot only)...")
+            model = SentenceTransformer(self.config.embedding_model, backend="onnx")
+            model.save_pretrained(model_dir)
+            export_dynamic_quantized_onnx_model(model, "avx512_vnni", model_dir)
+        
+        return SentenceTransformer(model_dir, backend="onnx", model_kwargs={"file_name": file_name})
+    
     def _setup_chromadb_storage(self):
         """Setup ChromaDB storage (local, ephemeral on Railway)"""
         try:
@@ -163,18 +578,84 @@ class RAGSystem(LoggerMixin):
             
             # Initialize ChromaDB
             self.chroma_client = chromadb.PersistentClient(path=self.config.chroma_path)
+            # Cosine space on unit vectors: similarity = 1 - distance is exact.
+            # Only applies to new collections; existing ones keep their space.
             self.collection = self.chroma_client.get_or_create_collection(
-                name=self.config.collection_name
+                name=self.config.collection_name,
+                metadata=self._collection_metadata()
             )
             
             # Wrap ChromaDB with our interface
-            self.storage = ChromaDBWrapper(self.collection, self.embedder)
+            self.storage = ChromaDBWrapper(
+                self.collection, self.embedder, self.config.embed_batch_size, self.config.sq8_scan
+            )
             self.log_success("ChromaDB storage initialized")
             
         except Exception as e:
             self.log_error(f"Failed to setup ChromaDB: {e}", e)
             raise
     
+    def _collection_metadata(self) -> Dict[str, Any]:
+        """HNSW index parameters for the Chroma collection"""
+        return {
+            "hnsw:space": "cosine",
+            "hnsw:M": self.config.hnsw_m,
+            "hnsw:construction_ef": self.config.hnsw_ef_construction,
+            "hnsw:search_ef": self.config.hnsw_ef_search
+        }
+    
+    def retune(self, **hnsw_kwargs) -> bool:
+        """
+        Rebuild the Chroma collection with new HNSW parameters
+        
+        Args:
+            hnsw_kwargs: any of hnsw_m, hnsw_ef_construction, hnsw_ef_search
+        
+        Returns:
+            True if the collection was rebuilt
+        """
+        if not isinstance(self.storage, ChromaDBWrapper):
+            self.log_warning("HNSW retuning is only supported on ChromaDB storage")
+            return False
+        
+        changed = {
+            key: value for key, value in hnsw_kwargs.items()
+            if key.startswith("hnsw_") and getattr(self.config, key, value) != value
+        }
+        if not changed:
+            return False
+        
+        try:
+            # Keep stored vectors so the rebuild does not re-run the embedder
+            existing = self.collection.get(include=["documents", "embeddings", "metadatas"])
+            
+            for key, value in changed.items():
+                setattr(self.config, key, value)
+            
+            self.chroma_client.delete_collection(self.config.collection_name)
+            self.collection = self.chroma_client.create_collection(
+                name=self.config.collection_name,
+                metadata=self._collection_metadata()
+            )
+            if existing["ids"]:
+                self.collection.add(
+                    ids=existing["ids"],
+                    documents=existing["documents"],
+                    embeddings=existing["embeddings"],
+                    metadatas=existing["metadatas"]
+                )
+            
+            self.storage = ChromaDBWrapper(
+                self.collection, self.embedder, self.config.embed_batch_size, self.config.sq8_scan
+            )
+            self.cache.clear()
+            self.log_success(f"Collection rebuilt with {changed}")
+            return True
+            
+        except Exception as e:
+            self.log_error(f"Error retuning collection: {e}", e)
+            return False
+    
     def _setup_supabase_storage(self):
         """Setup Supabase storage (persistent, cloud-based)"""
         try:
@@ -211,8 +692,8 @@ class RAGSystem(LoggerMixin):
                 ("Le piante d'appartamento come pothos e sansevieria purificano l'aria naturalmente e sono facili da curare.", "casa")
             ]
             
-            for text, category in base_knowledge:
-                self.add_knowledge(text, category)
+            texts, categories = zip(*base_knowledge)
+            self.add_knowledge_batch(list(texts), list(categories))
             
             self.log_success(f"Added {len(base_knowledge)} base knowledge items")
     
@@ -225,8 +706,8 @@ class RAGSystem(LoggerMixin):
         try:
             doc_id = self.storage.add_knowledge(content, category, metadata)
             
-            # Clear cache as new knowledge was added
-            self.cache.clear()
+            # Drop cached searches the new knowledge can affect
+            self._invalidate_categories([category])
             
             self.log_debug(f"Added knowledge: {doc_id}")
             return doc_id
@@ -235,8 +716,124 @@ class RAGSystem(LoggerMixin):
             self.log_error(f"Error adding knowledge: {e}", e)
             return ""
     
-    def search_knowledge(self, query: str, n_results: Optional[int] = None) -> List[Dict]:
-        """Search knowledge base"""
+    def add_knowledge_batch(self, contents: List[str], categories: List[str],
+                            metadatas: Optional[List[Optional[Dict]]] = None) -> List[str]:
+        """Add many knowledge items in one embedding pass"""
+        if not self.config.enabled or not self.storage:
+            self.log_warning("RAG system disabled, cannot add knowledge")
+            return []
+        
+        try:
+            doc_ids = self.storage.add_knowledge_batch(contents, categories, metadatas)
+            
+            # Drop cached searches the new knowledge can affect
+            self._invalidate_categories(categories)
+            
+            self.log_debug(f"Added {len(doc_ids)} knowledge items")
+            return doc_ids
+            
+        except Exception as e:
+            self.log_error(f"Error adding knowledge batch: {e}", e)
+            return []
+    
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Encode a query into a read-only float16 vector (half the memory of float32 in the LRU)"""
+        embedding = self.embedder.encode(
+            query, show_progress_bar=False, normalize_embeddings=True
+        ).astype(np.float16)
+        embedding.setflags(write=False)
+        return embedding
+    
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Cached, normalized query embedding (read-only float16), or None without RAG"""
+        if not self.config.enabled or self.embedder is None:
+            return None
+        return self._embed_query(query)
+    
+    def _invalidate_categories(self, categories: List[str]):
+        """Invalidate cached searches touching the given categories or with room for new hits"""
+        for tag in {*categories, self._PARTIAL_TAG}:
+            self.cache.invalidate_tag(tag)
+    
+    async def add_knowledge_async(self, content: str, category: str = "generale",
+                                  metadata: Optional[Dict] = None) -> str:
+        """Queue knowledge for micro-batched ingestion and wait for its document id"""
+        if not self.config.enabled or not self.storage:
+            self.log_warning("RAG system disabled, cannot add knowledge")
+            return ""
+        
+        future = asyncio.get_running_loop().create_future()
+        # Bounded queue: producers wait here when ingestion falls behind
+        await self._get_ingest_queue().put((content, category, metadata, future))
+        return await future
+    
+    def _get_ingest_queue(self) -> asyncio.Queue:
+        """Return the ingestion queue, (re)starting the worker for the running loop"""
+        loop = asyncio.get_running_loop()
+        if self._ingest_loop is not loop:
+            self._ingest_loop = loop
+            self._ingest_q = asyncio.Queue(maxsize=self.INGEST_QUEUE_SIZE)
+            self._ingest_task = loop.create_task(self._ingest_worker(self._ingest_q))
+        return self._ingest_q
+    
+    async def _ingest_worker(self, ingest_q: asyncio.Queue):
+        """Drain up to ingest_batch_size items (or INGEST_BATCH_INTERVAL) into one batched add"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await ingest_q.get()]
+            deadline = loop.time() + self.INGEST_BATCH_INTERVAL
+            while len(batch) < self.config.ingest_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(ingest_q.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            contents, categories, metadatas, futures = zip(*batch)
+            try:
+                doc_ids = await asyncio.to_thread(
+                    self.add_knowledge_batch, list(contents), list(categories), list(metadatas)
+                )
+            except asyncio.CancelledError:
+                for future in futures:
+                    future.cancel()
+                raise
+            except Exception as e:
+                self.log_error("Batched ingestion failed", e)
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for i, future in enumerate(futures):
+                    if not future.done():
+                        future.set_result(doc_ids[i] if i < len(doc_ids) else "")
+            finally:
+                for _ in batch:
+                    ingest_q.task_done()
+    
+    async def aclose(self):
+        """Ingest everything already queued, then stop the worker"""
+        task, self._ingest_task = self._ingest_task, None
+        ingest_q, self._ingest_q = self._ingest_q, None
+        loop, self._ingest_loop = self._ingest_loop, None
+        if task is None or task.done():
+            return
+        if loop is not asyncio.get_running_loop():
+            # Worker bound to another (finished) loop: nothing left to await here
+            task.cancel()
+            return
+        await ingest_q.join()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    def search_knowledge(self, query: str, n_results: Optional[int] = None,
+                         category: Optional[str] = None) -> List[Dict]:
+        """Search knowledge base, optionally restricted to one category"""
         if not self.config.enabled or not self.storage:
             return []
         
@@ -244,14 +841,15 @@ class RAGSystem(LoggerMixin):
             n_results = self.config.max_search_results
         
         # Check cache first
-        cache_key = f"search_{hash(query)}_{n_results}"
+        cache_key = f"search_{stable_hash(query)}_{n_results}_{category or '*'}"
         cached_result = self.cache.get(cache_key)
         if cached_result:
             self.log_debug(f"Cache hit for query: {query[:50]}...")
             return cached_result
         
         try:
-            knowledge_list = self.storage.search_knowledge(query, n_results)
+            query_embedding = self._embed_query(query).astype(np.float32)
+            knowledge_list = self.storage.search_knowledge(query, n_results, category, query_embedding)
             
             # Filter by similarity threshold
             filtered_list = [
@@ -259,8 +857,12 @@ class RAGSystem(LoggerMixin):
                 if item.get("similarity", 0) >= self.config.similarity_threshold
             ]
             
-            # Cache the results
-            self.cache.set(cache_key, filtered_list)
+            # Cache the results, tagged by the categories they depend on.
+            # Searches that returned fewer than n_results can gain any new document.
+            tags = {item.get("category", "generale") for item in knowledge_list}
+            if len(filtered_list) < n_results:
+                tags.add(self._PARTIAL_TAG)
+            self.cache.set(cache_key, filtered_list, tags=list(tags))
             
             self.log_debug(f"Found {len(filtered_list)} relevant knowledge items")
             return filtered_list
@@ -275,7 +877,12 @@ class RAGSystem(LoggerMixin):
             return {"enabled": False}
         
         try:
-            stats = self.storage.get_stats()
+            # Backend stats scan the whole store; reuse them briefly.
+            # Tagged as partial so any add_knowledge invalidates them immediately.
+            stats = self.cache.get(self._STATS_KEY)
+            if stats is None:
+                stats = self.storage.get_stats()
+                self.cache.set(self._STATS_KEY, stats, ttl=self.STATS_TTL, tags=[self._PARTIAL_TAG])
             
             # Normalize stats format for consistency
             # Handle different storage backend formats
@@ -310,6 +917,10 @@ class RAGSystem(LoggerMixin):
 class HomeChatbot(LoggerMixin):
     """Main Home Assistant Chatbot"""
     
+    # Output budgets per prompt type (capped by llm.max_tokens)
+    MAX_TOKENS_NO_CTX = 256
+    MAX_TOKENS_WITH_CTX = 512
+    
     def __init__(self, config: AppConfig):
         self.config = config
         self.log_info(f"Initializing {config.app_name} v{config.version}")
@@ -318,97 +929,182 @@ class HomeChatbot(LoggerMixin):
         self.llm_provider = LLMProvider(config)
         self.rag_system = RAGSystem(config)
         
-        # Initialize cache for responses
-        self.response_cache = MemoryCache(default_ttl=600)  # 10 minutes
+        # Dedicated pool for retrieval: bounds concurrent encodes without
+        # competing with other to_thread work on the default executor
+        self._embed_executor = ThreadPoolExecutor(
+            max_workers=max(1, config.rag.max_concurrent_embeds), thread_name_prefix="rag-embed"
+        )
+        
+        # Initialize cache for responses (shared across workers when Redis/diskcache is available).
+        # On disk it lives next to the vector store so it survives restarts with the same volume.
+        self.response_cache = SharedCache(
+            prefix="resp", ttl=600,  # 10 minutes
+            directory=os.path.join(config.rag.chroma_path, ".cache", "resp"),
+            max_entries=config.llm.max_cache_entries
+        )
+        self.log_info(f"Response cache backend: {self.response_cache.backend}")
         
         self.log_success("Chatbot initialized successfully")
     
-    async def get_response(self, user_message: str, user_id: Optional[str] = None, use_cache: bool = True) -> str:
-        """Generate response to user message"""
+    async def get_response(self, user_message: str, user_id: Optional[str] = None, use_cache: bool = True,
+                           stream: bool = False) -> Union[str, AsyncIterator[str]]:
+        """Generate response to user message (an async iterator of chunks if stream=True)"""
         self.log_method_call("get_response", 
                            message_length=len(user_message), 
                            user_id=user_id)
         
         # Check cache first
         if use_cache:
-            cache_key = f"response_{hash(user_message)}"
-            cached_response = self.response_cache.get(cache_key)
-            if cached_response:
+            cache_key = f"response_{stable_hash(user_message)}"
+            cached = await self.response_cache.aget(cache_key)
+            if cached and not cached["response"].startswith("⚠️"):
                 self.log_debug("Using cached response")
-                return cached_response
+                cached_response = cached["response"]
+                return self._iter_once(cached_response) if stream else cached_response
         
         try:
             # Search for relevant knowledge
             relevant_knowledge = []
-            if self.rag_system.config.enabled:
-                relevant_knowledge = self.rag_system.search_knowledge(user_message)
+            if self.rag_system.config.enabled and self.needs_retrieval(user_message):
+                # Embedding + vector query are CPU/IO bound: keep the event loop free
+                relevant_knowledge = await asyncio.get_running_loop().run_in_executor(
+                    self._embed_executor, self.rag_system.search_knowledge, user_message
+                )
             
             # Build prompt
             prompt = self._build_prompt(user_message, relevant_knowledge)
             
             # Generate response
             messages = [{"role": "user", "content": prompt}]
-            response = await self.llm_provider.generate_response(messages)
+            # Short questions without retrieved context go to the low-latency tier
+            tier = "instant" if not relevant_knowledge and len(user_message) < 200 else "balanced"
+            max_tokens = min(
+                self.MAX_TOKENS_WITH_CTX if relevant_knowledge else self.MAX_TOKENS_NO_CTX,
+                self.config.llm.max_tokens
+            )
+            if stream:
+                return self._stream_and_cache(messages, tier, max_tokens,
+                                              cache_key if use_cache else None, user_id)
+            
+            response = await self.llm_provider.generate_response(messages, tier=tier, max_tokens=max_tokens)
             
             # Cache the response
             if use_cache:
-                self.response_cache.set(cache_key, response)
+                await self._cache_response(cache_key, response, tier)
             
             self.log_success(f"Generated response for user {user_id}")
             return response
             
         except Exception as e:
             self.log_error(f"Error generating response: {e}", e)
-            return "⚠️ Mi dispiace, ho avuto un problema tecnico. Riprova tra poco!"
+            return ERROR_RESPONSE
+    
+    async def embed_query(self, text: str) -> Optional[np.ndarray]:
+        """Normalized query embedding (shared with retrieval's LRU), or None without RAG"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._embed_executor, self.rag_system.embed_query, text
+        )
+    
+    def needs_retrieval(self, user_message: str) -> bool:
+        """Gate for the RAG lookup, using the configured minimum query length"""
+        return needs_retrieval(user_message, self.config.rag.min_query_words)
+    
+    async def get_response_stream(self, user_message: str, user_id: Optional[str] = None,
+                                  use_cache: bool = True) -> AsyncIterator[str]:
+        """Yield the response as it is generated (usable directly with `async for`)"""
+        stream = await self.get_response(user_message, user_id, use_cache, stream=True)
+        if isinstance(stream, str):
+            # Errors before generation starts come back as a plain message
+            yield stream
+            return
+        async for chunk in stream:
+            yield chunk
+    
+    async def get_responses_batch(self, user_messages: List[str], user_id: Optional[str] = None) -> List[str]:
+        """Generate responses for several messages concurrently"""
+        return await asyncio.gather(*[self.get_response(message, user_id) for message in user_messages])
+    
+    async def _stream_and_cache(self, messages: List[Dict[str, str]], tier: str, max_tokens: int,
+                                cache_key: Optional[str], user_id: Optional[str]) -> AsyncIterator[str]:
+        """Relay LLM chunks and cache the full response once the stream completes"""
+        parts = []
+        try:
+            async for chunk in self.llm_provider.stream_response(messages, tier, max_tokens):
+                parts.append(chunk)
+                yield chunk
+        except Exception:
+            # Already logged by the provider; a failed generation is never cached
+            yield f"\n\n{ERROR_RESPONSE}" if parts else ERROR_RESPONSE
+            return
+        
+        if cache_key:
+            await self._cache_response(cache_key, "".join(parts).strip(), tier)
+        self.log_success(f"Streamed response for user {user_id}")
+    
+    async def _cache_response(self, cache_key: str, response: str, tier: str):
+        """Store the response together with its generation metadata"""
+        # The shared cache outlives the process: never persist empty or error replies
+        if not response or response.startswith("⚠️"):
+            return
+        await self.response_cache.aset(cache_key, {
+            "response": response,
+            "tier": tier,
+            "created_at": datetime.now().isoformat()
+        })
+    
+    @staticmethod
+    async def _iter_once(text: str) -> AsyncIterator[str]:
+        yield text
     
     def _build_prompt(self, user_message: str, relevant_knowledge: List[Dict]) -> str:
         """Build prompt for LLM"""
         if not relevant_knowledge:
-            return f"""Sei un assistente domestico esperto e amichevole specializzato in:
-- Consigli per la pulizia naturale della casa
-- Gestione delle utenze domestiche
-- Manutenzione casalinga
-- Organizzazione domestica
-
-Rispondi in italiano in modo pratico, dettagliato e amichevole.
-
-DOMANDA UTENTE: {user_message}"""
-        
-        # Build context from knowledge
-        context_parts = []
-        for knowledge in relevant_knowledge:
-            category = knowledge['category'].upper()
-            content = knowledge['content']
-            context_parts.append(f"[{category}] {content}")
+            return SYSTEM_PROMPT_NO_CTX + user_message
         
-        context = "\n".join(context_parts)
-        
-        return f"""Sei un assistente domestico esperto e amichevole specializzato in consigli per la casa.
-
-Ecco informazioni rilevanti dalla tua base di conoscenze:
-{context}
-
-DOMANDA UTENTE: {user_message}
-
-Rispondi in italiano incorporando naturalmente le informazioni della knowledge base quando rilevanti. 
-Sii pratico, dettagliato e amichevole. Se le informazioni della knowledge base non sono sufficienti, 
-integra con la tua conoscenza generale sui temi domestici."""
+        # Build context from knowledge; only the dynamic tail is assembled per request
+        context = "\n".join([f"[{_upper(k['category'])}] {k['content']}" for k in relevant_knowledge])
+        return "".join((SYSTEM_PROMPT_CTX_TMPL, context, _QUESTION_HEADER, user_message))
     
-    async def add_document(self, file_path: str, category: str = "documento") -> bool:
-        """Add document to knowledge base"""
+    async def add_document(self, file_path: str, category: str = "documento",
+                           source_name: Optional[str] = None) -> bool:
+        """Add document to knowledge base (source_name: original file name, if file_path is a temp file)"""
         try:
-            # This would normally process the document
-            # For now, just add a placeholder
-            content = f"Documento caricato: {os.path.basename(file_path)}"
-            doc_id = self.rag_system.add_knowledge(content, category)
+            # PDF parsing and embedding are CPU bound: keep the event loop free
+            chunks = await asyncio.to_thread(self._extract_document_chunks, file_path)
+            source_name = source_name or os.path.basename(file_path)
+            if not chunks:
+                # No extractable text: keep a placeholder so the upload is tracked
+                chunks = [f"Documento caricato: {source_name}"]
             
-            self.log_success(f"Document added: {file_path}")
-            return bool(doc_id)
+            source = {"source": source_name}
+            doc_ids = await asyncio.to_thread(
+                self.rag_system.add_knowledge_batch,
+                chunks, [category] * len(chunks), [source] * len(chunks)
+            )
+            
+            self.log_success(f"Document added: {file_path} ({len(doc_ids)} chunks)")
+            return bool(doc_ids)
             
         except Exception as e:
             self.log_error(f"Error adding document: {e}", e)
             return False
     
+    def _extract_document_chunks(self, file_path: str) -> List[str]:
+        """Extract text from a PDF and split it into chunks for embedding"""
+        try:
+            from PyPDF2 import PdfReader
+        except ImportError:
+            self.log_warning("PyPDF2 not available, storing document placeholder only")
+            return []
+        
+        try:
+            reader = PdfReader(file_path)
+            text = "\n".join(page.extract_text() or "" for page in reader.pages)
+            return chunk_text(text)
+        except Exception as e:
+            self.log_error(f"Error reading document {file_path}: {e}", e)
+            return []
+    
     def get_stats(self) -> Dict:
         """Get chatbot statistics"""
         rag_stats = self.rag_system.get_stats()
@@ -418,7 +1114,8 @@ integra con la tua conoscenza generale sui temi domestici."""
             "version": self.config.version,
             "environment": self.config.environment,
             "rag": rag_stats,
-            "cache_size": len(self.response_cache.cache),
+            "cache_size": len(self.response_cache),
+            "cache_backend": self.response_cache.backend,
             "uptime": "N/A"  # Would track actual uptime
         }
     
@@ -426,4 +1123,10 @@ integra con la tua conoscenza generale sui temi domestici."""
         """Clear all caches"""
         self.response_cache.clear()
         self.rag_system.cache.clear()
-        self.log_info("All caches cleared")
\ No newline at end of file
+        self.log_info("All caches cleared")
+    
+    async def aclose(self):
+        """Finish queued ingestion and release the embedding threads"""
+        await self.rag_system.aclose()
+        # Searches still running finish; queued ones are dropped with their callers
+        await asyncio.to_thread(self._embed_executor.shutdown, True, cancel_futures=True)
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+Embedding backends alternative to the PyTorch SentenceTransformer
+"""
+import os
+from typing import List, Union
+
+import numpy as np
+
+
+class OnnxEmbedder:
+    """
+    int8-quantized ONNX Runtime embedder with the SentenceTransformer.encode interface
+    
+    The model is exported with Optimum and dynamically quantized (AVX512-VNNI)
+    on first use; later starts load the quantized file from cache_dir.
+    """
+    
+    QUANTIZED_FILE = "model_quantized.onnx"
+    
+    def __init__(self, model_name: str, cache_dir: str = "./onnx_models"):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+        
+        model_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        model_dir = os.path.join(cache_dir, model_id.replace("/", "__"))
+        
+        # Export + dynamic int8 quantization only on first boot
+        if not os.path.exists(os.path.join(model_dir, self.QUANTIZED_FILE)):
+            model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+            quantizer = ORTQuantizer.from_pretrained(model)
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=model_dir, quantization_config=qconfig)
+            AutoTokenizer.from_pretrained(model_id).save_pretrained(model_dir)
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=self.QUANTIZED_FILE)
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.hidden_size
+    
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Tokenize, run the ORT session and mean-pool like SentenceTransformer"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[start:start + batch_size], padding=True,
+                                    truncation=True, return_tensors="np")
+            token_embeddings = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            batches.append(pooled.astype(np.float32))
+        
+        embeddings = np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
+
+
+class SQ8Codec:
+    """
+    Per-dimension int8 scalar quantizer (SQ8)
+    
+    Vectors are mapped to 256 levels between the calibrated per-dimension
+    min/max, 4x smaller than float32. Scoring is asymmetric: the float32
+    query is dotted with the int8 codes without decoding them first.
+    The calibrated range is widened by CALIBRATION_MARGIN on each side so
+    later vectors usually fit; use covers() to detect those that do not.
+    """
+    
+    LEVELS = 255
+    CALIBRATION_MARGIN = 0.05  # fraction of each dimension's span
+    
+    def __init__(self, dim: int):
+        # Default range suits L2-normalized embeddings until calibrate() is called
+        self.vmin = np.full(dim, -1.0, dtype=np.float32)
+        self.scale = np.full(dim, 2.0 / self.LEVELS, dtype=np.float32)
+    
+    def calibrate(self, vectors: np.ndarray) -> None:
+        """Fit per-dimension min/max on a sample of stored vectors"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        vmin, vmax = vectors.min(axis=0), vectors.max(axis=0)
+        margin = (vmax - vmin) * self.CALIBRATION_MARGIN
+        self.vmin = vmin - margin
+        self.scale = np.maximum(vmax + margin - self.vmin, 1e-6) / self.LEVELS
+    
+    def covers(self, vectors: np.ndarray) -> bool:
+        """Whether all values fall inside the calibrated range (quantize would not clip)"""
+        vectors = np.atleast_2d(vectors)
+        vmax = self.vmin + self.scale * self.LEVELS
+        return bool((vectors >= self.vmin).all() and (vectors <= vmax).all())
+    
+    def quantize(self, vectors: np.ndarray) -> np.ndarray:
+        """Encode float vectors to int8 codes (values outside the calibrated range are clipped)"""
+        codes = np.rint((np.atleast_2d(vectors) - self.vmin) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+    
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate dot products between a float32 query and int8 codes"""
+        # x ~= (code + 128) * scale + vmin  =>  q.x = (q * scale).code + q.(128 * scale + vmin)
+        query = np.asarray(query, dtype=np.float32)
+        offset = float(query @ (128 * self.scale + self.vmin))
+        return codes.astype(np.float32) @ (query * self.scale) + offset
@@ -0,0 +1,109 @@
+"""
+Semantic response cache keyed by query embeddings
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Response cache that also hits on paraphrases of a previous question
+    
+    Candidates are found with random-hyperplane LSH: each embedding gets one
+    n_bits signature per table, and only entries sharing at least one bucket
+    with the query are compared by cosine similarity. Several short tables
+    keep recall high for near-duplicates (cos >= 0.95) without scanning the
+    whole cache. Entries are scoped (e.g. per user), expire after ttl seconds
+    and are evicted in LRU order beyond max_entries.
+    """
+    
+    def __init__(self, dim: int, threshold: float = 0.95, n_tables: int = 4, n_bits: int = 8,
+                 max_entries: int = 2048, ttl: int = 600, seed: int = 0):
+        self.threshold = threshold
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.max_entries = max_entries
+        self.ttl = ttl
+        
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((n_tables * n_bits, dim)).astype(np.float32)
+        self._weights = 1 << np.arange(n_bits, dtype=np.int64)
+        
+        # entry id -> (vector, response, expires_at, bucket keys), in LRU order
+        self._entries: "OrderedDict[int, Tuple[np.ndarray, str, float, tuple]]" = OrderedDict()
+        self._buckets: Dict[tuple, Set[int]] = {}
+        self._next_id = 0
+    
+    def _keys(self, scope: Hashable, vec: np.ndarray) -> tuple:
+        """One bucket key per LSH table"""
+        bits = (self._planes @ vec > 0).reshape(self.n_tables, self.n_bits)
+        codes = bits @ self._weights
+        return tuple((scope, table, int(code)) for table, code in enumerate(codes))
+    
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
+    
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in entry[3]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+    
+    def get(self, scope: Hashable, embedding: np.ndarray) -> Optional[str]:
+        """Return the cached response most similar to embedding, if above threshold"""
+        vec = self._normalize(embedding)
+        now = time.monotonic()
+        
+        candidates = set()
+        for key in self._keys(scope, vec):
+            candidates.update(self._buckets.get(key, ()))
+        
+        best_id, best_sim, expired = None, self.threshold, []
+        for entry_id in candidates:
+            entry_vec, _, expires_at, _ = self._entries[entry_id]
+            if expires_at <= now:
+                expired.append(entry_id)
+                continue
+            sim = float(entry_vec @ vec)
+            if sim >= best_sim:
+                best_id, best_sim = entry_id, sim
+        
+        for entry_id in expired:
+            self._remove(entry_id)
+        
+        if best_id is None:
+            return None
+        self._entries.move_to_end(best_id)
+        return self._entries[best_id][1]
+    
+    def set(self, scope: Hashable, embedding: np.ndarray, response: str) -> None:
+        """Store response for the query embedding within scope"""
+        vec = self._normalize(embedding)
+        keys = self._keys(scope, vec)
+        entry_id = self._next_id
+        self._next_id += 1
+        
+        self._entries[entry_id] = (vec, response, time.monotonic() + self.ttl, keys)
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(entry_id)
+        
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+    
+    def clear(self) -> None:
+        self._entries.clear()
+        self._buckets.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
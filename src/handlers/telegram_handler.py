@@ -3,52 +3,63 @@ Telegram Bot Handler
 Handles all Telegram bot interactions
 """
 import os
-from typing import Optional
+import time
+import hashlib
+import asyncio
+import tempfile
+import contextlib
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, Final, FrozenSet, Optional, Set, Tuple
+
+import httpx
 from telegram import Update, BotCommand
+from telegram.constants import ChatType, ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
     filters, 
-    ContextTypes
+    ContextTypes,
+    Defaults
 )
 
-from core import HomeChatbot
-from utils import LoggerMixin
-from utils.helpers import RateLimiter
+try:
+    import aiofiles
+    AIOFILES_AVAILABLE = True
+except ImportError:
+    AIOFILES_AVAILABLE = False
 
+from core import HomeChatbot, SemanticCache
+from core.chatbot import ERROR_RESPONSE
+from utils import LoggerMixin
+from utils.helpers import AsyncTokenBucket, create_rate_limiter
+
+
+# Categories accepted by /addknowledge: the tuple fixes the order shown
+# to the user, the frozenset is used for lookups
+_DEFAULT_CATEGORY: Final[str] = 'generale'
+_CATEGORY_ORDER: Final[Tuple[str, ...]] = ('pulizia', 'utenze', 'manutenzione', 'casa', _DEFAULT_CATEGORY)
+_KNOWLEDGE_CATEGORIES: Final[FrozenSet[str]] = frozenset(_CATEGORY_ORDER)
+
+_UNAUTHORIZED: Final[str] = "⚠️ Non sei autorizzato a usare questo bot."
+
+# Command menu shown in the Telegram UI
+_BOT_COMMANDS: Final[Tuple[BotCommand, ...]] = (
+    BotCommand("start", "🤖 Avvia MarIA e mostra il benvenuto"),
+    BotCommand("help", "❓ Mostra l'elenco dei comandi disponibili"),
+    BotCommand("stats", "📊 Visualizza statistiche del bot"),
+    BotCommand("info", "ℹ️ Informazioni su MarIA"),
+    BotCommand("resources", "🔗 Link alle dashboard dei servizi"),
+    BotCommand("usage", "📈 Utilizzo in tempo reale dei servizi"),
+    BotCommand("addknowledge", "📚 Aggiungi conoscenza alla base dati"),
+)
 
-class TelegramBotHandler(LoggerMixin):
-    """Telegram Bot Handler"""
-    
-    def __init__(self, chatbot: HomeChatbot, config):
-        self.chatbot = chatbot
-        self.config = config.telegram
-        self.rate_limiter = RateLimiter(
-            max_calls=self.config.rate_limit_messages,
-            time_window=self.config.rate_limit_window
-        )
-        self.application = None
-        self.log_info("Telegram bot handler initialized")
-    
-    def is_user_allowed(self, user_id: int) -> bool:
-        """Check if user is allowed to use the bot"""
-        if self.config.allowed_users is None:
-            return True
-        return user_id in self.config.allowed_users
-    
-    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle /start command"""
-        user_id = update.effective_user.id
-        username = update.effective_user.first_name or "utente"
-        
-        self.log_info(f"Start command from user {user_id}")
-        
-        if not self.is_user_allowed(user_id):
-            await update.message.reply_text("⚠️ Non sei autorizzato a usare questo bot.")
-            return
-        
-        welcome_message = f"""🤖 Ciao {username}! Sono MarIA, la tua assistente domestica intelligente.
+# Static command texts, built once at import
+_WELCOME_TMPL: Final[str] = """🤖 Ciao {username}! Sono MarIA, la tua assistente domestica intelligente.
 
 📍 Al servizio di Via Santa Maria della Libera!
 
@@ -62,12 +73,8 @@ Posso aiutarti con:
 Usa /addknowledge per insegnarmi informazioni sulla tua casa, oppure inviami documenti PDF.
 
 Fai una domanda o usa /help per vedere tutti i comandi disponibili!"""
-        
-        await update.message.reply_text(welcome_message)
-    
-    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle /help command"""
-        help_text = """🤖 **Comandi disponibili:**
+
+_HELP_TEXT: Final[str] = """🤖 **Comandi disponibili:**
 
 **📋 Comandi Base:**
 /start - Avvia il bot
@@ -95,46 +102,8 @@ Fai una domanda o usa /help per vedere tutti i comandi disponibili!"""
 
 2. **PDF**: Invia un file PDF direttamente
 """
-        await update.message.reply_text(help_text, parse_mode='Markdown')
-    
-    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle /stats command"""
-        try:
-            stats = self.chatbot.get_stats()
-            
-            rag_info = stats.get('rag', {})
-            if rag_info.get('enabled'):
-                total_docs = rag_info.get('total_documents', 0)
-                categories = rag_info.get('categories', {})
-                cat_text = "\n".join([f"  • {cat}: {count}" for cat, count in categories.items()])
-                
-                stats_text = f"""📊 **Statistiche Bot**
 
-📚 **Database Conoscenze:**
-  • Totale documenti: {total_docs}
-  • Categorie:
-{cat_text}
-
-🤖 **Informazioni:**
-  • Versione: {stats.get('version', 'N/A')}
-  • Ambiente: {stats.get('environment', 'N/A')}
-"""
-            else:
-                stats_text = """📊 **Statistiche Bot**
-
-⚠️ Database RAG non attivo
-Usando solo conoscenza base del modello.
-"""
-            
-            await update.message.reply_text(stats_text, parse_mode='Markdown')
-            
-        except Exception as e:
-            self.log_error(f"Error getting stats: {e}", e)
-            await update.message.reply_text("❌ Errore nel recuperare le statistiche.")
-    
-    async def info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle /info command"""
-        info_text = """ℹ️ **Informazioni su MarIA**
+_INFO_TEXT: Final[str] = """ℹ️ **Informazioni su MarIA**
 
 🤖 Sono MarIA, la tua assistente domestica intelligente!
 📍 Al servizio di Via Santa Maria della Libera
@@ -155,11 +124,8 @@ Le mie specialità:
 • Inviami documenti PDF
 • Tutto viene salvato e usato per risponderti meglio!
 """
-        await update.message.reply_text(info_text, parse_mode='Markdown')
-    
-    async def resources_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle /resources command - show service dashboards and links"""
-        resources_text = """🔗 **Risorse e Dashboard**
+
+_RESOURCES_TEXT: Final[str] = """🔗 **Risorse e Dashboard**
 
 📊 **Monitoraggio Servizi:**
 
@@ -191,18 +157,298 @@ Le mie specialità:
 
 💡 Usa /usage per vedere l'utilizzo in tempo reale!
 """
-        await update.message.reply_text(resources_text, parse_mode='Markdown', disable_web_page_preview=True)
+
+_ADDKNOWLEDGE_USAGE: Final[str] = """📚 **Come aggiungere conoscenza:**
+
+**Formato:**
+`/addknowledge [categoria] testo della conoscenza`
+
+**Categorie disponibili:**
+""" + "\n".join(
+    f"• {cat} (default)" if cat == _DEFAULT_CATEGORY else f"• {cat}"
+    for cat in _CATEGORY_ORDER
+) + """
+
+**Esempi:**
+`/addknowledge utenze Il contratto luce scade il 31/12/2025`
+`/addknowledge pulizia Per il parquet usare solo panni umidi`
+`/addknowledge Il garage si chiude con il codice 1234`
+
+""" + f'Se non specifichi la categoria, verrà usata "{_DEFAULT_CATEGORY}".'
+
+
+class TelegramBotHandler(LoggerMixin):
+    """Telegram Bot Handler"""
+    
+    STATS_CACHE_TTL = 30  # seconds the /stats and /usage reports stay valid
+    MAX_CONCURRENT_PDFS = 4  # PDFs processed in parallel in the background
+    MAX_CONCURRENT_UPDATES = 32  # Telegram updates handled concurrently
+    # Connection pool for Bot API calls (PTB default: 1 connection)
+    CONNECTION_POOL_SIZE = 32
+    POOL_TIMEOUT = 1.0  # seconds
+    READ_TIMEOUT = 30.0  # seconds
+    TYPING_DELAY = 0.2  # seconds before showing "typing..."
+    # Semantic response cache: reuses the answer to near-identical questions
+    SEMANTIC_CACHE_THRESHOLD = 0.95  # minimum cosine similarity
+    SEMANTIC_CACHE_SIZE = 2048
+    SEMANTIC_CACHE_TTL = 600  # seconds, same as the response cache
+    # Outgoing message queue: Telegram limits a bot to ~30 messages/s
+    OUTGOING_RATE = 30
+    OUTGOING_BUFFER_SIZE = 1000
+    MAX_MESSAGE_LENGTH = 4096
+    SEND_MAX_ATTEMPTS = 3
+    SEND_RETRY_DELAY = 1.0  # seconds, multiplied by the attempt number
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes
+    
+    def __init__(self, chatbot: HomeChatbot, config, web_server=None):
+        self.chatbot = chatbot
+        self.config = config.telegram
+        # Optional web server, started on the bot's event loop
+        self.web_server = web_server
+        self.rate_limiter = create_rate_limiter(
+            max_calls=self.config.rate_limit_messages,
+            time_window=self.config.rate_limit_window,
+            algorithm=self.config.rate_limit_algorithm,
+            max_users=self.config.rate_limit_max_users
+        )
+        self.application = None
+        # Allow-list converted once: O(1) lookup on every message
+        allowed = self.config.allowed_users
+        self._allowed = None if allowed is None else frozenset(allowed)
+        # Fixed for the lifetime of the process, shown by /usage
+        self._env = os.getenv('ENVIRONMENT', 'development')
+        self._llm_model = chatbot.config.llm.model
+        self.semantic_cache = self._create_semantic_cache()
+        # (monotonic timestamp, formatted text)
+        self._stats_cache: Optional[Tuple[float, str]] = None
+        self._usage_cache: Optional[Tuple[float, str]] = None
+        # Background PDF processing: the semaphore bounds parallel work,
+        # the set keeps a reference to the running tasks
+        self._pdf_sem = asyncio.Semaphore(self.MAX_CONCURRENT_PDFS)
+        self._pdf_tasks: Set[asyncio.Task] = set()
+        # Created in post_init, on the application's loop
+        self._out_bucket = AsyncTokenBucket(rate=self.OUTGOING_RATE, capacity=self.OUTGOING_RATE)
+        self._out_queue: Optional[asyncio.Queue] = None
+        self._out_task: Optional[asyncio.Task] = None
+        # chat_id -> messages not sent yet, each drained in order by its own sender task;
+        # sends run concurrently, at most one per pooled connection
+        self._outboxes: Dict[int, Deque[Tuple[str, dict, bool]]] = {}
+        self._chat_senders: Set[asyncio.Task] = set()
+        self._send_sem = asyncio.Semaphore(self.CONNECTION_POOL_SIZE)
+        # Shared HTTP client for streaming file downloads
+        self._http = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0))
+        self.log_info("Telegram bot handler initialized")
+    
+    async def _send(self, update: Update, text: str, **kwargs) -> None:
+        """Reply to the update's chat through the rate-limited outgoing queue"""
+        if self._out_queue is None:
+            await update.message.reply_text(text, **kwargs)
+            return
+        # Same reply target reply_text would use: quote the message in groups only
+        if update.effective_chat.type != ChatType.PRIVATE:
+            kwargs.setdefault("reply_to_message_id", update.message.message_id)
+        await self._enqueue(update.effective_chat.id, text, **kwargs)
+    
+    async def _enqueue(self, chat_id: int, text: str, mergeable: bool = False, **kwargs) -> None:
+        """
+        Queue a message for the outgoing worker
+        
+        Only mergeable messages (standalone notifications) may be joined with
+        the next queued message for the same chat; replies are always sent as is.
+        """
+        if self._out_queue is None:
+            await self.application.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            return
+        await self._out_queue.put((chat_id, text, kwargs, mergeable))
+    
+    async def _send_worker(self, bot) -> None:
+        """Hand queued messages to per-chat senders, coalescing mergeable notifications"""
+        while True:
+            batch = [await self._out_queue.get()]
+            while not self._out_queue.empty():
+                batch.append(self._out_queue.get_nowait())
+            
+            for chat_id, text, kwargs, mergeable in batch:
+                self._out_queue.task_done()
+                outbox = self._outboxes.get(chat_id)
+                if outbox is None:
+                    outbox = self._outboxes[chat_id] = deque()
+                    task = asyncio.create_task(self._chat_sender(bot, chat_id, outbox))
+                    self._chat_senders.add(task)
+                    task.add_done_callback(self._chat_senders.discard)
+                elif mergeable and outbox:
+                    last_text, last_kwargs, last_mergeable = outbox[-1]
+                    if (last_mergeable and last_kwargs == kwargs
+                            and len(last_text) + len(text) + 2 <= self.MAX_MESSAGE_LENGTH):
+                        outbox[-1] = (f"{last_text}\n\n{text}", kwargs, True)
+                        continue
+                outbox.append((text, kwargs, mergeable))
+    
+    async def _chat_sender(self, bot, chat_id: int, outbox: Deque[Tuple[str, dict, bool]]) -> None:
+        """Send one chat's messages in order; retries only hold back this chat"""
+        try:
+            while outbox:
+                text, kwargs, _ = outbox.popleft()
+                await self._deliver(bot, chat_id, text, kwargs)
+        finally:
+            self._outboxes.pop(chat_id, None)
+    
+    async def _deliver(self, bot, chat_id: int, text: str, kwargs: dict) -> bool:
+        """Send one message, retrying on flood control and transient network errors"""
+        for attempt in range(1, self.SEND_MAX_ATTEMPTS + 1):
+            await self._out_bucket.acquire()
+            try:
+                async with self._send_sem:
+                    await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return True
+            except RetryAfter as e:
+                error, delay = e, float(e.retry_after)
+            except (BadRequest, Forbidden) as e:
+                # Not transient (bad markup, bot blocked): retrying cannot help
+                error = e
+                break
+            except NetworkError as e:
+                error, delay = e, self.SEND_RETRY_DELAY * attempt
+            if attempt < self.SEND_MAX_ATTEMPTS:
+                self.log_warning(f"Send to chat {chat_id} failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        self.log_error(f"Failed to send message to chat {chat_id}: {error}", error)
+        return False
+    
+    def _create_semantic_cache(self) -> Optional[SemanticCache]:
+        """Semantic cache sized on the embedder, None when RAG is disabled"""
+        embedder = self.chatbot.rag_system.embedder
+        if embedder is None:
+            return None
+        try:
+            dim = embedder.get_sentence_embedding_dimension()
+        except Exception as e:
+            self.log_warning(f"Semantic cache disabled: {e}")
+            return None
+        return SemanticCache(
+            dim,
+            threshold=self.SEMANTIC_CACHE_THRESHOLD,
+            max_entries=self.SEMANTIC_CACHE_SIZE,
+            ttl=self.SEMANTIC_CACHE_TTL
+        )
+    
+    async def _answer(self, user_message: str, uid_str: str) -> str:
+        """Get a response, reusing the user's answer to a near-identical question"""
+        embedding = None
+        # Trivial messages (greetings, thanks) are not embedded by
+        # get_response either: the exact response cache is enough for them
+        if self.semantic_cache is not None and self.chatbot.needs_retrieval(user_message):
+            # Same embedding retrieval uses afterwards (shared LRU)
+            embedding = await self.chatbot.embed_query(user_message)
+            if embedding is not None:
+                cached = self.semantic_cache.get(uid_str, embedding)
+                if cached is not None:
+                    self.log_debug(f"Semantic cache hit for user {uid_str}")
+                    return cached
+        
+        response = await self.chatbot.get_response(user_message, uid_str)
+        
+        if embedding is not None and response != ERROR_RESPONSE:
+            self.semantic_cache.set(uid_str, embedding, response)
+        return response
+    
+    async def _deny(self, update: Update) -> None:
+        """Tell a user outside the allow-list that they cannot use the bot"""
+        self.log_warning(f"Unauthorized access attempt from user {update.effective_user.id}")
+        await self._send(update, _UNAUTHORIZED)
+    
+    def is_user_allowed(self, user_id: int) -> bool:
+        """Check if user is allowed to use the bot"""
+        return self._allowed is None or user_id in self._allowed
+    
+    async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /start command"""
+        user_id = update.effective_user.id
+        username = update.effective_user.first_name or "utente"
+        
+        self.log_info(f"Start command from user {user_id}")
+        
+        if not self.is_user_allowed(user_id):
+            return await self._deny(update)
+        
+        await self._send(update, _WELCOME_TMPL.format(username=escape_markdown(username)))
+    
+    async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /help command"""
+        await self._send(update, _HELP_TEXT)
+    
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /stats command"""
+        try:
+            now = time.monotonic()
+            if self._stats_cache and now - self._stats_cache[0] < self.STATS_CACHE_TTL:
+                await self._send(update, self._stats_cache[1])
+                return
+            
+            # get_stats is synchronous and may query Supabase
+            stats = await asyncio.to_thread(self.chatbot.get_stats)
+            
+            rag_info = stats.get('rag', {})
+            if rag_info.get('enabled'):
+                total_docs = rag_info.get('total_documents', 0)
+                categories = rag_info.get('categories', {})
+                cat_text = "\n".join([f"  • {cat}: {count}" for cat, count in categories.items()])
+                
+                stats_text = f"""📊 **Statistiche Bot**
+
+📚 **Database Conoscenze:**
+  • Totale documenti: {total_docs}
+  • Categorie:
+{cat_text}
+
+🤖 **Informazioni:**
+  • Versione: {stats.get('version', 'N/A')}
+  • Ambiente: {stats.get('environment', 'N/A')}
+"""
+            else:
+                stats_text = """📊 **Statistiche Bot**
+
+⚠️ Database RAG non attivo
+Usando solo conoscenza base del modello.
+"""
+            
+            self._stats_cache = (now, stats_text)
+            await self._send(update, stats_text)
+            
+        except Exception as e:
+            self.log_error(f"Error getting stats: {e}", e)
+            await self._send(update, "❌ Errore nel recuperare le statistiche.")
+    
+    async def info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /info command"""
+        await self._send(update, _INFO_TEXT)
+    
+    async def resources_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /resources command - show service dashboards and links"""
+        await self._send(update, _RESOURCES_TEXT, disable_web_page_preview=True)
     
     async def usage_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /usage command - fetch real usage data from APIs"""
-        await update.message.reply_text("🔄 Recupero informazioni sull'utilizzo...")
-        
         try:
-            # Get Supabase stats
-            supabase_stats = self.chatbot.rag_system.storage.get_stats() if hasattr(self.chatbot.rag_system, 'storage') else {}
+            now = time.monotonic()
+            if self._usage_cache and now - self._usage_cache[0] < self.STATS_CACHE_TTL:
+                await self._send(update, self._usage_cache[1])
+                return
             
-            # Get environment
-            environment = os.getenv('ENVIRONMENT', 'development')
+            # Get Supabase stats: the blocking call runs in a thread
+            # while the progress message is sent
+            storage = getattr(self.chatbot.rag_system, 'storage', None)
+            _, supabase_stats = await asyncio.gather(
+                self._send(update, "🔄 Recupero informazioni sull'utilizzo..."),
+                asyncio.to_thread(storage.get_stats) if storage else asyncio.sleep(0, {})
+            )
+            
+            # Build categories block
+            categories = supabase_stats.get('by_category', {})
+            cats_block = "\n".join(
+                [f"  • {cat}: {count} documenti" for cat, count in categories.items()]
+                or ["  • Nessuna categoria"]
+            )
             
             # Build usage report
             usage_text = f"""📊 **Report Utilizzo Servizi**
@@ -213,26 +459,17 @@ Le mie specialità:
 • Spazio stimato: ~{supabase_stats.get('total', 0) * 2} KB / 500 MB
 • Stato: ✅ Operativo
 
-**📚 Categorie Documenti:**"""
-            
-            # Add categories
-            categories = supabase_stats.get('by_category', {})
-            if categories:
-                for cat, count in categories.items():
-                    usage_text += f"\n  • {cat}: {count} documenti"
-            else:
-                usage_text += "\n  • Nessuna categoria"
-            
-            usage_text += f"""
+**📚 Categorie Documenti:**
+{cats_block}
 
 **🚂 Railway (Hosting)**
-• Ambiente: {environment}
+• Ambiente: {self._env}
 • Stato: ✅ Online
 • Uptime: Bot attivo
 • Health check: http://localhost:10000/health
 
 **🤖 Groq (AI Model)**
-• Modello: {self.chatbot.config.llm.model}
+• Modello: {self._llm_model}
 • Rate limit: 30 req/minuto
 • Daily limit: 14,400 req/giorno
 • Stato: ✅ Operativo
@@ -244,11 +481,13 @@ Le mie specialità:
 • Usa /resources per link diretti alle dashboard
 """
             
-            await update.message.reply_text(usage_text, parse_mode='Markdown')
+            self._usage_cache = (now, usage_text)
+            await self._send(update, usage_text)
             
         except Exception as e:
             self.log_error(f"Error getting usage info: {e}", e)
-            await update.message.reply_text(
+            await self._send(
+                update,
                 "❌ Errore nel recuperare le informazioni sull'utilizzo.\n"
                 "Usa /resources per accedere alle dashboard manualmente."
             )
@@ -258,77 +497,59 @@ Le mie specialità:
         user_id = update.effective_user.id
         
         if not self.is_user_allowed(user_id):
-            await update.message.reply_text("⚠️ Non sei autorizzato a usare questo bot.")
-            return
+            return await self._deny(update)
         
         # Get the text after the command
         if not context.args:
-            await update.message.reply_text(
-                """📚 **Come aggiungere conoscenza:**
-
-**Formato:**
-`/addknowledge [categoria] testo della conoscenza`
-
-**Categorie disponibili:**
-• pulizia
-• utenze
-• manutenzione
-• casa
-• generale (default)
-
-**Esempi:**
-`/addknowledge utenze Il contratto luce scade il 31/12/2025`
-`/addknowledge pulizia Per il parquet usare solo panni umidi`
-`/addknowledge Il garage si chiude con il codice 1234`
-
-Se non specifichi la categoria, verrà usata "generale".""",
-                parse_mode='Markdown'
-            )
+            await self._send(update, _ADDKNOWLEDGE_USAGE)
             return
         
         try:
             # Parse category and content
-            categories = ['pulizia', 'utenze', 'manutenzione', 'casa', 'generale']
             first_word = context.args[0].lower()
-            
-            if first_word in categories:
-                category = first_word
-                content = ' '.join(context.args[1:])
-            else:
-                category = 'generale'
-                content = ' '.join(context.args)
+            has_category = first_word in _KNOWLEDGE_CATEGORIES
+            category = first_word if has_category else _DEFAULT_CATEGORY
+            # A single join: skip the first word only when it is the category
+            content = ' '.join(context.args[has_category:])
             
             if not content or len(content.strip()) < 10:
-                await update.message.reply_text(
+                await self._send(
+                    update,
                     "⚠️ Il contenuto è troppo corto. Scrivi almeno 10 caratteri."
                 )
                 return
             
             # Add to knowledge base
             if self.chatbot.rag_system.config.enabled:
-                doc_id = self.chatbot.rag_system.add_knowledge(content, category)
+                doc_id = await self.chatbot.rag_system.add_knowledge_async(content, category)
                 
                 if doc_id:
-                    await update.message.reply_text(
+                    shown = content if len(content) <= 100 else content[:100] + '…'
+                    await self._send(
+                        update,
                         f"""✅ **Conoscenza aggiunta!**
 
 📁 Categoria: {category}
-📝 Contenuto: {content[:100]}{'...' if len(content) > 100 else ''}
+📝 Contenuto: {shown}
 🆔 ID: {doc_id}
 
-Ora posso usare questa informazione per rispondere alle domande!"""
+Ora posso usare questa informazione per rispondere alle domande!""",
+                        # Content and id come from the user: no Markdown
+                        parse_mode=None
                     )
                     self.log_success(f"Knowledge added by user {user_id}: {doc_id}")
                 else:
-                    await update.message.reply_text("❌ Errore nell'aggiungere la conoscenza.")
+                    await self._send(update, "❌ Errore nell'aggiungere la conoscenza.")
             else:
-                await update.message.reply_text(
+                await self._send(
+                    update,
                     "⚠️ Il sistema RAG è disabilitato. Non posso aggiungere conoscenze."
                 )
                 
         except Exception as e:
             self.log_error(f"Error adding knowledge: {e}", e)
-            await update.message.reply_text(
+            await self._send(
+                update,
                 "❌ Errore nell'aggiungere la conoscenza. Riprova!"
             )
     
@@ -336,123 +557,227 @@ Ora posso usare questa informazione per rispondere alle domande!"""
         """Handle user messages"""
         user_message = update.message.text
         user_id = update.effective_user.id
+        uid_str = str(user_id)
         
         # Check if user is allowed
         if not self.is_user_allowed(user_id):
-            await update.message.reply_text("⚠️ Non sei autorizzato a usare questo bot.")
-            return
+            return await self._deny(update)
         
         # Check rate limit
-        if not self.rate_limiter.is_allowed(str(user_id)):
-            reset_time = self.rate_limiter.get_reset_time(str(user_id))
-            await update.message.reply_text(
+        if not self.rate_limiter.is_allowed(uid_str):
+            reset_time = self.rate_limiter.get_reset_time(uid_str)
+            await self._send(
+                update,
                 f"⚠️ Troppi messaggi! Riprova tra qualche secondo."
             )
             return
         
         try:
-            # Show typing indicator
-            await context.bot.send_chat_action(
-                chat_id=update.effective_chat.id, 
-                action="typing"
-            )
-            
             # Get response from chatbot
             self.log_info(f"Processing message from user {user_id}: {user_message[:50]}...")
-            response = await self.chatbot.get_response(user_message, str(user_id))
+            resp_task = asyncio.create_task(self._answer(user_message, uid_str))
+            
+            # Show the typing indicator only if the response is not immediate
+            # (e.g. a cache hit): saves a Telegram API call
+            done, _ = await asyncio.wait({resp_task}, timeout=self.TYPING_DELAY)
+            if not done:
+                try:
+                    await context.bot.send_chat_action(
+                        chat_id=update.effective_chat.id, 
+                        action="typing"
+                    )
+                except Exception as e:
+                    self.log_warning(f"Failed to send typing action: {e}")
+            
+            response = await resp_task
             
             # Send response
-            await update.message.reply_text(response)
+            # LLM output is not controlled Markdown: send it as is
+            await self._send(update, response, parse_mode=None)
             self.log_success(f"Response sent to user {user_id}")
             
         except Exception as e:
             self.log_error(f"Error processing message: {e}", e)
-            await update.message.reply_text(
+            await self._send(
+                update,
                 "⚠️ Scusa, ho avuto un problema tecnico. Riprova tra poco!"
             )
     
     async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle PDF documents"""
+        """Handle PDF documents (only registered for filters.Document.PDF)"""
         user_id = update.effective_user.id
         
         if not self.is_user_allowed(user_id):
-            await update.message.reply_text("⚠️ Non sei autorizzato a usare questo bot.")
-            return
-        
-        if not update.message.document or update.message.document.mime_type != 'application/pdf':
-            await update.message.reply_text("⚠️ Per favore invia solo file PDF.")
-            return
+            return await self._deny(update)
         
+        file_path = None
         try:
-            await context.bot.send_chat_action(
-                chat_id=update.effective_chat.id,
-                action="upload_document"
+            # Download file: the chat action is sent alongside get_file
+            _, file = await asyncio.gather(
+                context.bot.send_chat_action(
+                    chat_id=update.effective_chat.id,
+                    action="upload_document"
+                ),
+                context.bot.get_file(update.message.document.file_id)
             )
+            # Unique name in the temp directory: no collisions between
+            # concurrent uploads and no path derived from the user's file name
+            with tempfile.NamedTemporaryFile(prefix='tg_pdf_', suffix='.pdf', delete=False) as tmp:
+                file_path = tmp.name
+            await self._download_file(file, file_path)
             
-            # Download file
-            file = await context.bot.get_file(update.message.document.file_id)
-            file_path = f"temp_{update.message.document.file_name}"
-            await file.download_to_drive(file_path)
-            
-            self.log_info(f"Processing PDF: {file_path}")
-            
-            # Process PDF
-            success = await self.chatbot.add_document(file_path)
-            
-            if success:
-                await update.message.reply_text(
-                    "✅ Documento aggiunto al database delle conoscenze!"
-                )
-                self.log_success(f"Document added: {file_path}")
-            else:
-                await update.message.reply_text(
-                    "❌ Errore nel processare il documento."
-                )
+            # Parsing and embedding run in the background so updates
+            # from other chats are not blocked
+            task = asyncio.create_task(
+                self._process_pdf(file_path, update.effective_chat.id, update.message.document.file_name)
+            )
+            self._pdf_tasks.add(task)
+            task.add_done_callback(self._pdf_tasks.discard)
+            # From here on the task owns the file
+            file_path = None
             
-            # Clean up
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            await self._send(
+                update,
+                "⏳ Documento ricevuto, lo sto elaborando..."
+            )
                 
         except Exception as e:
             self.log_error(f"Error processing PDF: {e}", e)
-            await update.message.reply_text(
+            await self._send(
+                update,
                 "❌ Errore nel caricare il documento."
             )
+        finally:
+            # Download failed: remove the temp file already created
+            if file_path:
+                Path(file_path).unlink(missing_ok=True)
+    
+    async def _download_file(self, file, file_path: str) -> None:
+        """Stream a Telegram file to disk in fixed-size chunks (constant memory)"""
+        url = file.file_path
+        if not url or not url.startswith(("http://", "https://")):
+            # Local Bot API server: the file is already on disk
+            await file.download_to_drive(file_path)
+            return
+        
+        async with self._http.stream("GET", url) as response:
+            response.raise_for_status()
+            if AIOFILES_AVAILABLE:
+                async with aiofiles.open(file_path, "wb") as afp:
+                    async for chunk in response.aiter_bytes(self.DOWNLOAD_CHUNK_SIZE):
+                        await afp.write(chunk)
+            else:
+                with open(file_path, "wb") as fp:
+                    async for chunk in response.aiter_bytes(self.DOWNLOAD_CHUNK_SIZE):
+                        fp.write(chunk)
+    
+    async def _process_pdf(self, file_path: str, chat_id: int, file_name: Optional[str] = None) -> None:
+        """Add a downloaded PDF to the knowledge base and notify the chat"""
+        try:
+            async with self._pdf_sem:
+                self.log_info(f"Processing PDF: {file_path}")
+                
+                success = await self.chatbot.add_document(file_path, source_name=file_name)
+                
+                if success:
+                    await self._enqueue(
+                        chat_id,
+                        "✅ Documento aggiunto al database delle conoscenze!",
+                        mergeable=True
+                    )
+                    self.log_success(f"Document added: {file_path}")
+                else:
+                    await self._enqueue(
+                        chat_id,
+                        "❌ Errore nel processare il documento.",
+                        mergeable=True
+                    )
+                    
+        except Exception as e:
+            self.log_error(f"Error processing PDF: {e}", e)
+            await self._enqueue(
+                chat_id,
+                "❌ Errore nel processare il documento.",
+                mergeable=True
+            )
+        finally:
+            # Clean up on errors and on cancellation, even while waiting for the semaphore
+            Path(file_path).unlink(missing_ok=True)
     
     def setup_handlers(self, application: Application) -> None:
         """Setup command and message handlers"""
         application.add_handler(CommandHandler("start", self.start_command))
         application.add_handler(CommandHandler("help", self.help_command))
-        application.add_handler(CommandHandler("stats", self.stats_command))
+        application.add_handler(CommandHandler("stats", self.stats_command, block=False))
         application.add_handler(CommandHandler("info", self.info_command))
         application.add_handler(CommandHandler("resources", self.resources_command))
-        application.add_handler(CommandHandler("usage", self.usage_command))
-        application.add_handler(CommandHandler("addknowledge", self.addknowledge_command))
+        application.add_handler(CommandHandler("usage", self.usage_command, block=False))
+        application.add_handler(CommandHandler("addknowledge", self.addknowledge_command, block=False))
         application.add_handler(
-            MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message)
+            MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message, block=False)
         )
         application.add_handler(
-            MessageHandler(filters.Document.PDF, self.handle_document)
+            MessageHandler(filters.Document.PDF, self.handle_document, block=False)
         )
         self.log_success("Telegram handlers configured")
     
     async def setup_bot_commands(self, application: Application) -> None:
-        """Setup bot command menu visible in Telegram UI"""
-        commands = [
-            BotCommand("start", "🤖 Avvia MarIA e mostra il benvenuto"),
-            BotCommand("help", "❓ Mostra l'elenco dei comandi disponibili"),
-            BotCommand("stats", "📊 Visualizza statistiche del bot"),
-            BotCommand("info", "ℹ️ Informazioni su MarIA"),
-            BotCommand("resources", "🔗 Link alle dashboard dei servizi"),
-            BotCommand("usage", "📈 Utilizzo in tempo reale dei servizi"),
-            BotCommand("addknowledge", "📚 Aggiungi conoscenza alla base dati"),
-        ]
+        """Setup bot command menu visible in Telegram UI (only when it changed)"""
+        # Telegram stores the menu: resend it only when it changes.
+        # The hash file sits next to the vector store, on the persistent volume.
+        hash_path = os.path.join(self.chatbot.config.rag.chroma_path, ".bot_commands_hash")
+        commands = [(c.command, c.description) for c in _BOT_COMMANDS]
+        digest = hashlib.blake2b(
+            repr((application.bot.id, commands)).encode(), digest_size=8
+        ).hexdigest()
+        
+        try:
+            with open(hash_path, encoding="utf-8") as f:
+                if f.read().strip() == digest:
+                    self.log_info("Bot commands menu unchanged, skipping update")
+                    return
+        except OSError:
+            pass
         
         try:
-            await application.bot.set_my_commands(commands)
+            await application.bot.set_my_commands(_BOT_COMMANDS)
             self.log_success("Bot commands menu configured")
         except Exception as e:
             self.log_error(f"Failed to setup bot commands menu: {e}", e)
+            return
+        
+        try:
+            os.makedirs(os.path.dirname(hash_path) or ".", exist_ok=True)
+            with open(hash_path, "w", encoding="utf-8") as f:
+                f.write(digest)
+        except OSError as e:
+            self.log_warning(f"Could not store bot commands hash: {e}")
+    
+    async def _post_init(self, application: Application) -> None:
+        """Start the outgoing message worker and the command menu"""
+        self._out_queue = asyncio.Queue(maxsize=self.OUTGOING_BUFFER_SIZE)
+        self._out_task = asyncio.create_task(self._send_worker(application.bot))
+        await self.setup_bot_commands(application)
+    
+    async def _post_shutdown(self, application: Application) -> None:
+        """Stop the web server, pending PDF tasks, the chatbot, the outgoing worker and the download client"""
+        if self.web_server:
+            await self.web_server.stop()
+        # PDFs still being processed: each task removes its temp file when cancelled
+        for task in self._pdf_tasks:
+            task.cancel()
+        await asyncio.gather(*self._pdf_tasks, return_exceptions=True)
+        # Knowledge already queued is still stored before the process exits
+        await self.chatbot.aclose()
+        if self._out_task:
+            self._out_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._out_task
+        for task in self._chat_senders:
+            task.cancel()
+        await asyncio.gather(*self._chat_senders, return_exceptions=True)
+        self._out_queue = None
+        await self._http.aclose()
     
     def run(self) -> None:
         """Start the Telegram bot"""
@@ -463,13 +788,33 @@ Ora posso usare questa informazione per rispondere alle domande!"""
             raise ValueError(f"Missing {self.config.token_env} environment variable")
         
         # Create application
-        self.application = Application.builder().token(token).build()
+        self.application = (
+            Application.builder()
+            .token(token)
+            .request(HTTPXRequest(
+                connection_pool_size=self.CONNECTION_POOL_SIZE,
+                pool_timeout=self.POOL_TIMEOUT,
+                read_timeout=self.READ_TIMEOUT
+            ))
+            # Long polling gets its own client so it does not tie up the pool
+            .get_updates_request(HTTPXRequest(read_timeout=self.READ_TIMEOUT))
+            .concurrent_updates(self.MAX_CONCURRENT_UPDATES)
+            # Markdown for every reply; handlers stay blocking unless registered with block=False
+            .defaults(Defaults(parse_mode=ParseMode.MARKDOWN))
+            .build()
+        )
         
         # Setup handlers
         self.setup_handlers(self.application)
         
-        # Setup bot commands menu (async operation)
-        self.application.post_init = self.setup_bot_commands
+        # Setup bot commands menu and outgoing queue (async operation)
+        self.application.post_init = self._post_init
+        self.application.post_shutdown = self._post_shutdown
+        
+        # Health/admin server up before Application.initialize (getMe can take a while or
+        # retry), on the loop run_polling will use; _post_shutdown stops it
+        if self.web_server:
+            asyncio.get_event_loop().run_until_complete(self.web_server.start())
         
         # Start bot
         self.log_info("Starting Telegram bot...")
@@ -0,0 +1,162 @@
+"""
+Web Server Handler
+Health checks and admin API served with aiohttp on the bot's event loop
+"""
+import os
+import hmac
+import asyncio
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
+
+from core import HomeChatbot
+from utils import LoggerMixin
+from utils.helpers import create_error_response, create_success_response
+
+
+class WebServer(LoggerMixin):
+    """Async web server sharing the process's chatbot"""
+    
+    UPLOAD_CHUNK_SIZE = 64 * 1024  # bytes
+    
+    def __init__(self, chatbot: HomeChatbot, config):
+        self.chatbot = chatbot
+        self.config = config.web
+        self.api_token = os.getenv('WEB_API_TOKEN')
+        self.app = self.create_app()
+        self._runner: Optional[web.AppRunner] = None
+        self.log_info("Web server handler initialized")
+    
+    def create_app(self) -> web.Application:
+        """Build the aiohttp application; admin routes only exist when WEB_API_TOKEN is set"""
+        app = web.Application(middlewares=[self._auth_middleware])
+        app.router.add_get('/', self.index)
+        app.router.add_get('/health', self.health)
+        if not self.api_token:
+            self.log_warning("WEB_API_TOKEN not set: admin API disabled")
+            return app
+        # Admin API used by the Streamlit panel
+        app.router.add_post('/chat', self.chat)
+        app.router.add_get('/stats', self.stats)
+        app.router.add_post('/add_knowledge', self.add_knowledge)
+        app.router.add_post('/add_document', self.add_document)
+        app.router.add_post('/clear_cache', self.clear_cache)
+        return app
+    
+    @web.middleware
+    async def _auth_middleware(self, request: web.Request, handler):
+        """Require a valid X-API-Token header on every route except / and /health"""
+        if request.path not in ('/', '/health') and not self._token_ok(request):
+            return web.json_response(
+                create_error_response("unauthorized", "Invalid or missing API token"), status=401
+            )
+        return await handler(request)
+    
+    def _token_ok(self, request: web.Request) -> bool:
+        token = request.headers.get('X-API-Token', '')
+        return bool(self.api_token) and hmac.compare_digest(token.encode(), self.api_token.encode())
+    
+    async def index(self, request: web.Request) -> web.Response:
+        """Health check endpoint"""
+        return web.json_response({
+            "status": "running",
+            "service": "MarIA - Smart Home Assistant",
+            "message": "🤖 MarIA is active!"
+        })
+    
+    async def health(self, request: web.Request) -> web.Response:
+        """Health check endpoint"""
+        return web.json_response({"status": "healthy"})
+    
+    async def _json(self, request: web.Request) -> dict:
+        try:
+            data = await request.json()
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+    
+    async def chat(self, request: web.Request) -> web.Response:
+        """Generate a response with the shared chatbot"""
+        data = await self._json(request)
+        message = (data.get('message') or '').strip()
+        if not message:
+            return web.json_response(create_error_response("validation_error", "Missing 'message'"), status=400)
+        
+        response = await self.chatbot.get_response(message, data.get('user_id', 'web'))
+        return web.json_response(create_success_response({"response": response}))
+    
+    async def stats(self, request: web.Request) -> web.Response:
+        """Chatbot statistics"""
+        stats = await asyncio.to_thread(self.chatbot.get_stats)
+        return web.json_response(create_success_response(stats))
+    
+    async def add_knowledge(self, request: web.Request) -> web.Response:
+        """Add a knowledge entry to the shared knowledge base"""
+        data = await self._json(request)
+        content = (data.get('content') or '').strip()
+        if not content:
+            return web.json_response(create_error_response("validation_error", "Missing 'content'"), status=400)
+        
+        doc_id = await self.chatbot.rag_system.add_knowledge_async(content, data.get('category', 'generale'))
+        if not doc_id:
+            return web.json_response(create_error_response("rag_error", "Knowledge not added"), status=500)
+        return web.json_response(create_success_response({"id": doc_id}))
+    
+    async def add_document(self, request: web.Request) -> web.Response:
+        """Add an uploaded PDF (multipart 'file' + optional 'category') to the knowledge base"""
+        category = 'documento'
+        temp_path = None
+        file_name = None
+        try:
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == 'category':
+                    category = await part.text()
+                elif part.name == 'file':
+                    file_name = part.filename
+                    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+                        temp_path = f.name
+                        while chunk := await part.read_chunk(self.UPLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+            
+            if temp_path is None:
+                return web.json_response(create_error_response("validation_error", "Missing 'file'"), status=400)
+            
+            success = await self.chatbot.add_document(temp_path, category, source_name=file_name)
+            return web.json_response(create_success_response({"success": success}))
+        finally:
+            if temp_path:
+                Path(temp_path).unlink(missing_ok=True)
+    
+    async def clear_cache(self, request: web.Request) -> web.Response:
+        """Clear the response cache, the RAG search cache or both"""
+        target = (await self._json(request)).get('target', 'all')
+        if target in ('response', 'all'):
+            await asyncio.to_thread(self.chatbot.response_cache.clear)
+        if target in ('rag', 'all'):
+            self.chatbot.rag_system.cache.clear()
+        return web.json_response(create_success_response(message=f"Cache cleared: {target}"))
+    
+    async def start(self) -> None:
+        """Start serving on the running event loop (no extra thread)"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.config.host, self.config.port).start()
+        self.log_success(f"Web server listening on {self.config.host}:{self.config.port}")
+    
+    async def stop(self) -> None:
+        """Stop the web server"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    def run(self) -> None:
+        """Run the web server standalone (Telegram bot disabled)"""
+        self.app.on_cleanup.append(self._close_chatbot)
+        web.run_app(self.app, host=self.config.host, port=self.config.port, access_log=None)
+    
+    async def _close_chatbot(self, app: web.Application) -> None:
+        """Standalone mode owns the chatbot: drain its ingestion on shutdown"""
+        await self.chatbot.aclose()
@@ -2,18 +2,18 @@
 Web Interface for Home Assistant Chatbot
 Streamlit-based admin interface
 """
+import os
 import sys
 from pathlib import Path
-import asyncio
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import requests
 import streamlit as st
 from dotenv import load_dotenv
 
 from utils import ConfigManager
-from core import HomeChatbot
 
 load_dotenv()
 
@@ -24,11 +24,52 @@ st.set_page_config(
     layout="wide"
 )
 
+class ChatbotAPI:
+    """HTTP client for the admin API served by main.py
+    
+    The panel talks to the running bot process instead of building its own
+    HomeChatbot, so the embedding model, vector index and caches are shared.
+    """
+    
+    def __init__(self, base_url: str, token: str, timeout: float = 120):
+        if not token:
+            raise RuntimeError("WEB_API_TOKEN is not set: the admin API is disabled")
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["X-API-Token"] = token
+    
+    def _request(self, method: str, path: str, **kwargs) -> dict:
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        if response.status_code == 404:
+            raise RuntimeError("Admin API not available (is WEB_API_TOKEN set for the bot?)")
+        payload = response.json()
+        if not payload.get("success"):
+            raise RuntimeError(payload.get("error", {}).get("message", f"HTTP {response.status_code}"))
+        return payload.get("data")
+    
+    def get_stats(self) -> dict:
+        return self._request("GET", "/stats")
+    
+    def get_response(self, message: str, user_id: str = "web") -> str:
+        return self._request("POST", "/chat", json={"message": message, "user_id": user_id})["response"]
+    
+    def add_knowledge(self, content: str, category: str) -> str:
+        return self._request("POST", "/add_knowledge", json={"content": content, "category": category})["id"]
+    
+    def add_document(self, filename: str, data: bytes, category: str) -> bool:
+        files = {"file": (filename, data, "application/pdf")}
+        return self._request("POST", "/add_document", files=files, data={"category": category})["success"]
+    
+    def clear_cache(self, target: str = "all") -> None:
+        self._request("POST", "/clear_cache", json={"target": target})
+
 @st.cache_resource
 def get_chatbot():
-    """Get or create chatbot instance"""
-    config_manager = ConfigManager()
-    return HomeChatbot(config_manager.config), config_manager.config
+    """Get the admin API client for the running chatbot"""
+    config = ConfigManager().config
+    base_url = os.getenv('CHATBOT_API_URL', f"http://localhost:{config.web.port}")
+    return ChatbotAPI(base_url, os.getenv('WEB_API_TOKEN')), config
 
 def main():
     """Main web interface"""
@@ -37,9 +78,11 @@ def main():
     # Load chatbot
     try:
         chatbot, config = get_chatbot()
+        stats = chatbot.get_stats()
     except Exception as e:
-        st.error(f"❌ Error initializing chatbot: {e}")
+        st.error(f"❌ Error connecting to chatbot: {e}")
         st.stop()
+    rag_enabled = stats.get('rag', {}).get('enabled', False)
     
     # Sidebar
     with st.sidebar:
@@ -53,8 +96,6 @@ def main():
     if page == "Dashboard":
         st.header("📊 Dashboard")
         
-        stats = chatbot.get_stats()
-        
         col1, col2, col3 = st.columns(3)
         
         with col1:
@@ -107,12 +148,12 @@ def main():
                 submitted = st.form_submit_button("Add Knowledge")
                 
                 if submitted and knowledge_text:
-                    if chatbot.rag_system.config.enabled:
-                        doc_id = chatbot.rag_system.add_knowledge(knowledge_text, category)
-                        if doc_id:
+                    if rag_enabled:
+                        try:
+                            doc_id = chatbot.add_knowledge(knowledge_text, category)
                             st.success(f"✅ Knowledge added successfully! ID: {doc_id}")
                             st.rerun()
-                        else:
+                        except Exception:
                             st.error("❌ Error adding knowledge")
                     else:
                         st.warning("⚠️ RAG system is disabled in configuration")
@@ -132,20 +173,15 @@ def main():
                     )
                 
                 if st.button("Process Document"):
-                    if chatbot.rag_system.config.enabled:
+                    if rag_enabled:
                         with st.spinner("Processing document..."):
-                            # Save temp file
-                            temp_path = f"temp_{uploaded_file.name}"
-                            with open(temp_path, "wb") as f:
-                                f.write(uploaded_file.getvalue())
-                            
-                            # Process
-                            success = asyncio.run(chatbot.add_document(temp_path, doc_category))
-                            
-                            # Cleanup
-                            import os
-                            if os.path.exists(temp_path):
-                                os.remove(temp_path)
+                            # Process (the bot process stores it in a temp file)
+                            try:
+                                success = chatbot.add_document(
+                                    uploaded_file.name, uploaded_file.getvalue(), doc_category
+                                )
+                            except Exception:
+                                success = False
                             
                             if success:
                                 st.success("✅ Document processed successfully!")
@@ -179,7 +215,7 @@ def main():
             # Get bot response
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
-                    response = asyncio.run(chatbot.get_response(prompt, "web_test"))
+                    response = chatbot.get_response(prompt, "web_test")
                     st.markdown(response)
             
             # Add assistant message
@@ -218,19 +254,19 @@ def main():
         
         with col1:
             if st.button("Clear Response Cache"):
-                chatbot.response_cache.clear()
+                chatbot.clear_cache("response")
                 st.success("✅ Response cache cleared!")
         
         with col2:
             if st.button("Clear RAG Cache"):
-                if chatbot.rag_system.config.enabled:
-                    chatbot.rag_system.cache.clear()
+                if rag_enabled:
+                    chatbot.clear_cache("rag")
                     st.success("✅ RAG cache cleared!")
                 else:
                     st.warning("RAG system is disabled")
         
         st.subheader("System Information")
-        st.json(chatbot.get_stats())
+        st.json(stats)
 
 if __name__ == "__main__":
     main()
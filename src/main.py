@@ -5,45 +5,19 @@ Supports both Telegram bot and web interface
 import os
 import sys
 from pathlib import Path
-from threading import Thread
-from flask import Flask
 from dotenv import load_dotenv
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from utils import ConfigManager, setup_logging
-from core import HomeChatbot
+from core import HomeChatbot, configure_cpu_threads
 from handlers.telegram_handler import TelegramBotHandler
+from handlers.web_handler import WebServer
 
 # Load environment variables
 load_dotenv()
 
-# Flask app for health checks (required by some hosting services)
-app = Flask(__name__)
-
-@app.route('/')
-def index():
-    """Health check endpoint"""
-    return {
-        "status": "running",
-        "service": "MarIA - Smart Home Assistant",
-        "message": "🤖 MarIA is active!"
-    }, 200
-
-@app.route('/health')
-def health():
-    """Health check endpoint"""
-    return {"status": "healthy"}, 200
-
-def run_flask(config):
-    """Run Flask web server"""
-    app.run(
-        host=config.web.host,
-        port=config.web.port,
-        debug=config.web.debug
-    )
-
 def main():
     """Main function"""
     print("=" * 60)
@@ -78,6 +52,10 @@ def main():
     
     log.info("✅ Configuration validated successfully")
     
+    # Limit torch CPU threads once, before any model is loaded
+    threads = configure_cpu_threads(config.rag.cpu_threads)
+    log.info(f"Using {threads} CPU threads for inference")
+    
     # Initialize chatbot
     try:
         log.info("Initializing chatbot core...")
@@ -97,17 +75,14 @@ def main():
         traceback.print_exc()
         sys.exit(1)
     
-    # Start web server in background (for health checks)
-    if config.web.enabled:
-        log.info(f"🌐 Starting web server on {config.web.host}:{config.web.port}")
-        web_thread = Thread(target=run_flask, args=(config,), daemon=True)
-        web_thread.start()
+    # Web server (health checks + admin API): runs on the bot's event loop
+    web_server = WebServer(chatbot, config) if config.web.enabled else None
     
     # Start Telegram bot
     if config.telegram.enabled:
         log.info("🤖 Starting Telegram bot...")
         try:
-            telegram_handler = TelegramBotHandler(chatbot, config)
+            telegram_handler = TelegramBotHandler(chatbot, config, web_server=web_server)
             log.info("✅ Telegram bot is running!")
             log.info("Press Ctrl+C to stop")
             print("\n" + "=" * 60)
@@ -121,15 +96,10 @@ def main():
             sys.exit(1)
     else:
         log.info("Telegram bot disabled in configuration")
-        if config.web.enabled:
+        if web_server:
+            log.info(f"🌐 Starting web server on {config.web.host}:{config.web.port}")
             log.info("Web server is running. Press Ctrl+C to stop")
-            # Keep the program running
-            try:
-                while True:
-                    import time
-                    time.sleep(1)
-            except KeyboardInterrupt:
-                log.info("Shutting down...")
+            web_server.run()
 
 if __name__ == '__main__':
     try:
@@ -6,6 +6,7 @@ import os
 from typing import List, Dict, Optional, Any
 from datetime import datetime
 import hashlib
+from collections import Counter
 import requests
 
 from sentence_transformers import SentenceTransformer
@@ -135,7 +136,7 @@ class SupabaseStorage(LoggerMixin):
             doc_id = generate_document_id(content, category)
             
             # Generate embedding
-            embedding = self.embedder.encode(content).tolist()
+            embedding = self.embedder.encode(content, show_progress_bar=False).tolist()
             
             # Prepare metadata
             doc_metadata = metadata or {}
@@ -167,7 +168,64 @@ class SupabaseStorage(LoggerMixin):
             self.log_error(f"Error adding knowledge: {e}", e)
             return ""
     
-    def search_knowledge(self, query: str, n_results: int = 3, category: Optional[str] = None) -> List[Dict]:
+    def add_knowledge_batch(self, contents: List[str], categories: List[str],
+                            metadatas: Optional[List[Optional[Dict]]] = None) -> List[str]:
+        """
+        Add many knowledge items with one encode pass and one bulk upsert
+        
+        Args:
+            contents: The knowledge texts
+            categories: Category for each text
+            metadatas: Optional additional metadata for each text
+        
+        Returns:
+            List of document IDs (empty on failure)
+        """
+        if not contents:
+            return []
+        
+        try:
+            embeddings = self._encode_batch(contents).tolist()
+            
+            added_at = datetime.now().isoformat()
+            rows = []
+            for i, (content, category) in enumerate(zip(contents, categories)):
+                doc_metadata = dict(metadatas[i] or {}) if metadatas else {}
+                doc_metadata["category"] = category
+                doc_metadata["added_at"] = added_at
+                rows.append({
+                    "id": generate_document_id(content, category),
+                    "content": content,
+                    "category": category,
+                    "embedding": embeddings[i],
+                    "metadata": doc_metadata
+                })
+            
+            # PostgREST accepts a JSON array for bulk insert/upsert
+            response = requests.post(
+                f"{self.base_url}/rest/v1/{self.table_name}",
+                headers={**self.headers, "Prefer": "resolution=merge-duplicates"},
+                json=rows,
+                timeout=60
+            )
+            response.raise_for_status()
+            
+            self.log_debug(f"Added {len(rows)} knowledge items in batch")
+            return [row["id"] for row in rows]
+            
+        except Exception as e:
+            self.log_error(f"Error adding knowledge batch: {e}", e)
+            return []
+    
+    def _encode_batch(self, texts: List[str]):
+        """Encode many texts in one length-sorted (smart-batched) call, order preserved"""
+        return self.embedder.encode(
+            texts, batch_size=getattr(self.config, 'embed_batch_size', 32), show_progress_bar=False,
+            convert_to_numpy=True, normalize_embeddings=True
+        )
+    
+    def search_knowledge(self, query: str, n_results: int = 3, category: Optional[str] = None,
+                         query_embedding=None) -> List[Dict]:
         """
         Search knowledge using vector similarity
         
@@ -175,13 +233,16 @@ class SupabaseStorage(LoggerMixin):
             query: Search query
             n_results: Number of results to return
             category: Optional category filter
+            query_embedding: Precomputed query embedding (skips encoding)
         
         Returns:
             List of knowledge items with similarity scores
         """
         try:
-            # Generate query embedding
-            query_embedding = self.embedder.encode(query).tolist()
+            # Generate query embedding unless the caller already has it
+            if query_embedding is None:
+                query_embedding = self.embedder.encode(query, show_progress_bar=False)
+            query_embedding = query_embedding.tolist()
             
             # Call Supabase RPC function for vector similarity search
             rpc_params = {
@@ -317,10 +378,7 @@ class SupabaseStorage(LoggerMixin):
             response.raise_for_status()
             data = response.json()
             
-            categories = {}
-            for item in data:
-                cat = item.get("category", "generale")
-                categories[cat] = categories.get(cat, 0) + 1
+            categories = dict(Counter(item.get("category", "generale") for item in data))
             
             return {
                 "total": total,
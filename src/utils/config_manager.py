@@ -17,6 +17,7 @@ class LLMConfig:
     temperature: float = 0.7
     max_tokens: int = 500
     api_key_env: str = "GROQ_API_KEY"
+    max_cache_entries: int = 10000  # response cache bound (in-process backend)
 
 
 @dataclass
@@ -29,6 +30,19 @@ class RAGConfig:
     collection_name: str = "home_assistant"
     max_search_results: int = 3
     similarity_threshold: float = 0.7
+    embedder_backend: str = "torch"  # torch, onnx (int8 VNNI) or openvino
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    cpu_threads: int = 0  # embedder intra-op threads, 0 = half the logical cores
+    embed_batch_size: int = 32
+    device: str = "auto"  # auto, cpu or cuda
+    fp16: bool = True  # half precision embedder weights on CUDA
+    sq8_scan: bool = False  # int8 brute-force scan + exact rerank; +25% vector RAM on top of Chroma, O(N) per query
+    max_concurrent_embeds: int = 4
+    ingest_batch_size: int = 32
+    min_query_words: int = 1  # shorter messages skip retrieval
+    compile_model: bool = False  # torch.compile the embedder (PyTorch >= 2.0)
 
 
 @dataclass
@@ -39,6 +53,8 @@ class TelegramConfig:
     allowed_users: Optional[list] = None
     rate_limit_messages: int = 20
     rate_limit_window: int = 60  # seconds
+    rate_limit_algorithm: str = "token_bucket"  # token_bucket | sliding_window
+    rate_limit_max_users: int = 10000
 
 
 @dataclass
@@ -158,7 +174,8 @@ class ConfigManager:
                     "model": config.llm.model,
                     "temperature": config.llm.temperature,
                     "max_tokens": config.llm.max_tokens,
-                    "api_key_env": config.llm.api_key_env
+                    "api_key_env": config.llm.api_key_env,
+                    "max_cache_entries": config.llm.max_cache_entries
                 },
                 "rag": {
                     "enabled": config.rag.enabled,
@@ -166,14 +183,29 @@ class ConfigManager:
                     "chroma_path": config.rag.chroma_path,
                     "collection_name": config.rag.collection_name,
                     "max_search_results": config.rag.max_search_results,
-                    "similarity_threshold": config.rag.similarity_threshold
+                    "similarity_threshold": config.rag.similarity_threshold,
+                    "embedder_backend": config.rag.embedder_backend,
+                    "hnsw_m": config.rag.hnsw_m,
+                    "hnsw_ef_construction": config.rag.hnsw_ef_construction,
+                    "hnsw_ef_search": config.rag.hnsw_ef_search,
+                    "cpu_threads": config.rag.cpu_threads,
+                    "embed_batch_size": config.rag.embed_batch_size,
+                    "device": config.rag.device,
+                    "fp16": config.rag.fp16,
+                    "sq8_scan": config.rag.sq8_scan,
+                    "max_concurrent_embeds": config.rag.max_concurrent_embeds,
+                    "ingest_batch_size": config.rag.ingest_batch_size,
+                    "min_query_words": config.rag.min_query_words,
+                    "compile_model": config.rag.compile_model
                 },
                 "telegram": {
                     "enabled": config.telegram.enabled,
                     "token_env": config.telegram.token_env,
                     "allowed_users": config.telegram.allowed_users,
                     "rate_limit_messages": config.telegram.rate_limit_messages,
-                    "rate_limit_window": config.telegram.rate_limit_window
+                    "rate_limit_window": config.telegram.rate_limit_window,
+                    "rate_limit_algorithm": config.telegram.rate_limit_algorithm,
+                    "rate_limit_max_users": config.telegram.rate_limit_max_users
                 },
                 "web": {
                     "enabled": config.web.enabled,
@@ -244,4 +276,8 @@ class ConfigManager:
 
 # Environment
 ENVIRONMENT={self.config.environment}
+
+# Admin API for the web panel (/chat, /stats, /add_knowledge): only served when WEB_API_TOKEN is set
+# WEB_API_TOKEN=choose_a_secret_token
+# CHATBOT_API_URL=http://localhost:{self.config.web.port}
 """
\ No newline at end of file
@@ -2,18 +2,68 @@
 Utility functions for the chatbot application
 """
 import os
+import time
 import hashlib
 import asyncio
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
 import json
+from collections import OrderedDict
+
+from .logger import LoggerMixin
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 
 def generate_document_id(content: str, category: str = "general") -> str:
-    """Generate unique document ID based on content hash"""
-    content_hash = hashlib.md5(content.encode()).hexdigest()[:8]
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    return f"{category}_{timestamp}_{content_hash}"
+    """Generate deterministic document ID based on content hash"""
+    content_hash = hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+    return f"{category}_{content_hash}"
+
+
+def stable_hash(text: str) -> str:
+    """Stable cross-process hash for cache keys (unlike built-in hash())"""
+    if XXHASH_AVAILABLE:
+        return xxhash.xxh3_128_hexdigest(text.encode('utf-8'))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def ts_ns() -> int:
+    """Current Unix time in nanoseconds (JSON-native, sortable metadata timestamp)"""
+    return time.time_ns()
+
+
+def iso_from_ns(ns: int) -> str:
+    """Format a ts_ns() value as ISO-8601 for display"""
+    return datetime.fromtimestamp(ns / 1e9).isoformat()
+
+
+def chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
+    """Split text into overlapping chunks, breaking on whitespace when possible"""
+    text = " ".join(text.split())
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            space = text.rfind(" ", start, end)
+            if space > start:
+                end = space
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
 
 
 def sanitize_filename(filename: str) -> str:
@@ -67,39 +117,170 @@ def is_valid_url(url: str) -> bool:
     return pattern.match(url) is not None
 
 
+def _validate_limits(max_calls: int, time_window: int, max_users: int) -> None:
+    """Reject rate limiter settings that would divide by zero or evict from an empty table"""
+    if max_calls < 1:
+        raise ValueError(f"max_calls must be at least 1, got {max_calls}")
+    if time_window <= 0:
+        raise ValueError(f"time_window must be positive, got {time_window}")
+    if max_users < 1:
+        raise ValueError(f"max_users must be at least 1, got {max_users}")
+
+
 class RateLimiter:
-    """Simple rate limiter for API calls"""
+    """Token-bucket rate limiter for API calls.
+    
+    Each user holds at most ``max_calls`` tokens, refilled continuously at
+    ``max_calls / time_window`` tokens per second; a call costs one token.
+    """
     
-    def __init__(self, max_calls: int, time_window: int):
+    def __init__(self, max_calls: int, time_window: int, max_users: int = 10000):
+        _validate_limits(max_calls, time_window, max_users)
         self.max_calls = max_calls
         self.time_window = time_window
-        self.calls = {}
+        self.max_users = max_users
+        self.capacity = float(max_calls)
+        self.rate = max_calls / time_window
+        # user_id -> (tokens, last_refill), last_refill from time.monotonic();
+        # kept in last-access order so idle users can be evicted
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def _refill(self, user_id: str, now: float) -> float:
+        """Return the user's current token count after lazy refill"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            return self.capacity
+        tokens, last = bucket
+        return min(self.capacity, tokens + (now - last) * self.rate)
     
     def is_allowed(self, user_id: str) -> bool:
         """Check if user is allowed to make a call"""
-        now = datetime.now()
-        user_calls = self.calls.get(user_id, [])
+        now = time.monotonic()
+        buckets = self._buckets
+        tokens = self._refill(user_id, now)
+        if user_id in buckets:
+            buckets.move_to_end(user_id)
+        else:
+            # Only a new user can push the table past max_users
+            while len(buckets) >= self.max_users:
+                buckets.popitem(last=False)
+        
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        buckets[user_id] = (tokens, now)
+        return allowed
+    
+    def get_reset_time(self, user_id: str) -> Optional[datetime]:
+        """Get when the next call will be allowed for user"""
+        if user_id not in self._buckets:
+            return None
         
-        # Remove old calls outside time window
-        cutoff_time = now - timedelta(seconds=self.time_window)
-        user_calls = [call_time for call_time in user_calls if call_time > cutoff_time]
+        tokens = self._refill(user_id, time.monotonic())
+        if tokens >= 1.0:
+            return None
         
-        # Check if under limit
-        if len(user_calls) < self.max_calls:
-            user_calls.append(now)
-            self.calls[user_id] = user_calls
+        return datetime.now() + timedelta(seconds=(1.0 - tokens) / self.rate)
+
+
+class SlidingWindowRateLimiter:
+    """Sliding-window-counter rate limiter for API calls.
+    
+    Approximates an exact sliding window with two fixed-window counters:
+    the previous window's count is weighted by how much of it still
+    overlaps the sliding window. Unlike the token bucket it does not
+    allow a full burst right after an idle period.
+    """
+    
+    def __init__(self, max_calls: int, time_window: int, max_users: int = 10000):
+        _validate_limits(max_calls, time_window, max_users)
+        self.max_calls = max_calls
+        self.time_window = time_window
+        self.max_users = max_users
+        # user_id -> [prev_count, curr_count, window_index], in LRU order
+        self._w: "OrderedDict[str, list]" = OrderedDict()
+    
+    def _window(self, user_id: str, now: float) -> list:
+        """Return the user's counters rolled forward to the current window"""
+        index = int(now // self.time_window)
+        state = self._w.get(user_id)
+        if state is None:
+            state = [0, 0, index]
+            self._w[user_id] = state
+            while len(self._w) > self.max_users:
+                self._w.popitem(last=False)
+        elif state[2] != index:
+            # After more than one full window the previous count is zero
+            state[0] = state[1] if state[2] == index - 1 else 0
+            state[1] = 0
+            state[2] = index
+        return state
+    
+    def _estimate(self, state: list, now: float) -> float:
+        elapsed = (now % self.time_window) / self.time_window
+        return state[0] * (1.0 - elapsed) + state[1]
+    
+    def is_allowed(self, user_id: str) -> bool:
+        """Check if user is allowed to make a call"""
+        now = time.monotonic()
+        state = self._window(user_id, now)
+        self._w.move_to_end(user_id)
+        if self._estimate(state, now) < self.max_calls:
+            state[1] += 1
             return True
-        
         return False
     
     def get_reset_time(self, user_id: str) -> Optional[datetime]:
-        """Get when rate limit resets for user"""
-        user_calls = self.calls.get(user_id, [])
-        if not user_calls:
+        """Get when the next call will be allowed for user"""
+        if user_id not in self._w:
+            return None
+        
+        now = time.monotonic()
+        state = self._window(user_id, now)
+        if self._estimate(state, now) < self.max_calls:
             return None
         
-        oldest_call = min(user_calls)
-        return oldest_call + timedelta(seconds=self.time_window)
+        if state[1] >= self.max_calls or state[0] == 0:
+            # Only the next window frees a slot
+            wait = self.time_window - (now % self.time_window)
+        else:
+            # Wait until the previous window's weight has decayed enough
+            needed = 1.0 - (self.max_calls - state[1]) / state[0]
+            wait = max(0.0, needed * self.time_window - (now % self.time_window))
+        return datetime.now() + timedelta(seconds=wait)
+
+
+class AsyncTokenBucket:
+    """Async token bucket: ``acquire`` waits until a token is available.
+    
+    Several coroutines on one event loop may share it: there is no await
+    between the refill check and taking the token, so no lock is needed.
+    """
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+    
+    async def acquire(self) -> None:
+        """Take one token, sleeping until it has been refilled if needed"""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(float(self.capacity), self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+            await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+def create_rate_limiter(max_calls: int, time_window: int,
+                        algorithm: str = "token_bucket", max_users: int = 10000):
+    """Create the rate limiter selected by ``algorithm``"""
+    if algorithm == "sliding_window":
+        return SlidingWindowRateLimiter(max_calls, time_window, max_users)
+    return RateLimiter(max_calls, time_window, max_users)
 
 
 class MemoryCache:
@@ -157,6 +338,149 @@ class MemoryCache:
         return len(expired_keys)
 
 
+class LRUCache(MemoryCache):
+    """Bounded in-memory LRU cache with TTL and tag-based invalidation"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: int = 300):
+        super().__init__(default_ttl=ttl)
+        self.cache = OrderedDict()
+        self.maxsize = maxsize
+    
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, tags: Optional[List[str]] = None) -> None:
+        """Set cache value with TTL and optional invalidation tags"""
+        super().set(key, value, ttl)
+        self.cache[key]['tags'] = frozenset(tags or ())
+        self.cache.move_to_end(key)
+        
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+    
+    def get(self, key: str) -> Any:
+        """Get cache value and mark it as recently used"""
+        value = super().get(key)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        return value
+    
+    def invalidate_tag(self, tag: str) -> int:
+        """Remove all entries carrying the tag, return count of removed items"""
+        tagged_keys = [key for key, item in self.cache.items() if tag in item.get('tags', ())]
+        for key in tagged_keys:
+            del self.cache[key]
+        return len(tagged_keys)
+
+
+class SharedCache(LoggerMixin):
+    """
+    Keyed JSON cache that can be shared across processes and restarts
+    
+    Backends, in order of preference: Redis (when REDIS_URL is set),
+    diskcache, then a per-process LRUCache fallback. Redis and disk calls
+    block on I/O, so async code should use aget/aset, which run them in a
+    worker thread.
+    """
+    
+    def __init__(self, prefix: str, ttl: int = 300, redis_url: Optional[str] = None,
+                 directory: Optional[str] = None, max_entries: int = 10000):
+        self.prefix = prefix
+        self.default_ttl = ttl
+        self.backend = "memory"
+        self._redis = None
+        self._disk = None
+        self._memory = None
+        
+        redis_url = redis_url or os.getenv("REDIS_URL")
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url)
+                self._redis.ping()
+                self.backend = "redis"
+            except Exception as e:
+                self.log_warning(f"Redis unavailable ({e}), falling back to a local cache")
+                self._redis = None
+        
+        if self._redis is None:
+            try:
+                import diskcache
+                self._disk = diskcache.Cache(directory or os.path.join(".cache", prefix))
+                self.backend = "disk"
+            except ImportError:
+                self._memory = LRUCache(maxsize=max_entries, ttl=ttl)
+    
+    def _full_key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+    
+    def get(self, key: str) -> Any:
+        """Get cache value, return None if expired or not found"""
+        full_key = self._full_key(key)
+        if self._redis is not None:
+            raw = self._redis.get(full_key)
+        elif self._disk is not None:
+            raw = self._disk.get(full_key)
+        else:
+            raw = self._memory.get(full_key)
+        if raw is None:
+            return None
+        return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+    
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """Set JSON-serializable cache value with TTL"""
+        if ttl is None:
+            ttl = self.default_ttl
+        
+        full_key = self._full_key(key)
+        # Compact UTF-8 bytes with orjson; plain json text otherwise
+        raw = orjson.dumps(value) if ORJSON_AVAILABLE else json.dumps(value, ensure_ascii=False)
+        if self._redis is not None:
+            self._redis.set(full_key, raw, ex=ttl)
+        elif self._disk is not None:
+            self._disk.set(full_key, raw, expire=ttl)
+        else:
+            self._memory.set(full_key, raw, ttl)
+    
+    async def aget(self, key: str) -> Any:
+        """get() without blocking the event loop on Redis/disk I/O"""
+        if self._memory is not None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+    
+    async def aset(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """set() without blocking the event loop on Redis/disk I/O"""
+        if self._memory is not None:
+            self.set(key, value, ttl)
+            return
+        await asyncio.to_thread(self.set, key, value, ttl)
+    
+    def delete(self, key: str) -> bool:
+        """Delete cache key"""
+        full_key = self._full_key(key)
+        if self._redis is not None:
+            return bool(self._redis.delete(full_key))
+        if self._disk is not None:
+            return self._disk.delete(full_key)
+        return self._memory.delete(full_key)
+    
+    def clear(self) -> None:
+        """Clear all keys under this cache prefix"""
+        if self._redis is not None:
+            keys = list(self._redis.scan_iter(match=f"{self.prefix}:*"))
+            if keys:
+                self._redis.delete(*keys)
+        elif self._disk is not None:
+            self._disk.clear()
+        else:
+            self._memory.clear()
+    
+    def __len__(self) -> int:
+        if self._redis is not None:
+            # O(1) DBSIZE: counts every key in the Redis database, not only this prefix
+            return self._redis.dbsize()
+        if self._disk is not None:
+            return len(self._disk)
+        return len(self._memory.cache)
+
+
 async def retry_async(func, max_retries: int = 3, delay: float = 1.0, backoff_factor: float = 2.0):
     """Retry async function with exponential backoff"""
     last_exception = None
@@ -0,0 +1,70 @@
+"""
+Filtered knowledge search on a real (in-memory) Chroma collection
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("groq")
+
+import chromadb
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from core.chatbot import ChromaDBWrapper
+
+
+class FakeEmbedder:
+    """Deterministic unit vectors: no model download needed"""
+
+    DIM = 8
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.DIM
+
+    def encode(self, texts, **kwargs):
+        single = isinstance(texts, str)
+        vectors = []
+        for text in [texts] if single else texts:
+            rng = np.random.default_rng(sum(map(ord, text)))
+            vec = rng.standard_normal(self.DIM).astype(np.float32)
+            vectors.append(vec / np.linalg.norm(vec))
+        return vectors[0] if single else np.stack(vectors)
+
+
+@pytest.fixture
+def wrapper():
+    client = chromadb.EphemeralClient()
+    collection = client.create_collection("knowledge", metadata={"hnsw:space": "cosine"})
+    return ChromaDBWrapper(collection, FakeEmbedder())
+
+
+def test_category_smaller_than_n_results(wrapper):
+    wrapper.add_knowledge_batch(
+        [f"documento generale {i}" for i in range(10)] + ["aceto e bicarbonato"],
+        ["generale"] * 10 + ["pulizia"],
+    )
+
+    results = wrapper.search_knowledge("come pulisco il forno", n_results=5, category="pulizia")
+
+    assert [r["content"] for r in results] == ["aceto e bicarbonato"]
+
+
+def test_unknown_category_returns_nothing(wrapper):
+    wrapper.add_knowledge("aceto e bicarbonato", "pulizia")
+
+    assert wrapper.search_knowledge("bollette", n_results=3, category="utenze") == []
+
+
+def test_category_counts_survive_reopen(wrapper):
+    wrapper.add_knowledge_batch(["a", "b", "c"], ["pulizia", "pulizia", "utenze"])
+
+    reopened = ChromaDBWrapper(wrapper.collection, FakeEmbedder())
+
+    assert reopened.count() == 3
+    assert len(reopened.search_knowledge("x", n_results=5, category="pulizia")) == 2